@@ -0,0 +1,167 @@
+import os
+import math
+import logging
+from typing import Dict, List, Optional, Tuple
+import utils
+from code_analysis import build_import_graph, count_importers
+
+# モジュール固有のロガーを設定
+logger = logging.getLogger(__name__)
+
+# ステージ名と予算設定キーの対応
+STAGE_BUDGET_KEYS = {
+    'spec': 'spec_token_budget',
+    'detailed': 'detailed_token_budget',
+    'refactoring': 'refactoring_token_budget'
+}
+
+# エントリーポイントとして優先するファイル名
+ENTRY_POINT_NAMES = ('main.py', '__main__.py', 'app.py', 'manage.py')
+
+class BudgetPlan:
+    """トークン予算に基づくファイル選定結果"""
+
+    def __init__(self, stage: str, budget: int, selected: List[Dict], omitted: List[Dict],
+                 preamble: str = ""):
+        self.stage = stage
+        self.budget = budget
+        self.selected = selected
+        self.omitted = omitted
+        # 最初のファイルブロックより前の部分（見出しとディレクトリ構造）
+        self.preamble = preamble
+
+    @property
+    def used_tokens(self) -> int:
+        """選定したファイルの合計トークン数"""
+        return sum(item['tokens'] for item in self.selected)
+
+    def omitted_notice(self) -> str:
+        """省略したファイルの一覧を生成"""
+        if not self.omitted:
+            return ""
+        lines = [f"## トークン予算により省略されたファイル（予算: {self.budget} tokens）"]
+        lines.extend(f"- {item['rel_path']} (約{item['tokens']} tokens)" for item in self.omitted)
+        return "\n".join(lines) + "\n"
+
+    def render_code(self) -> str:
+        """選定したファイルをmerge.txt形式で連結"""
+        content = self.preamble or "# Merged Python Files (token budget applied)\n\n"
+        # 元の並び順を維持して出力
+        for item in sorted(self.selected, key=lambda x: x['order']):
+            content += utils.format_file_block(item['rel_path'], item['content'])
+        notice = self.omitted_notice()
+        if notice:
+            content += f"\n{notice}"
+        return content
+
+class TokenBudgetPlanner:
+    """重要度に基づいてトークン予算内に収まるファイルを選定するクラス"""
+
+    def __init__(self, settings: dict):
+        """設定を読み込んで初期化"""
+        self.settings = settings
+        self.project_dir = os.path.abspath(settings['source_directory'])
+
+    def get_budget(self, stage: str) -> int:
+        """ステージのトークン予算を取得（0 は無制限）"""
+        key = STAGE_BUDGET_KEYS.get(stage)
+        if not key:
+            return 0
+        return max(utils.get_int_setting(self.settings, key), 0)
+
+    def _get_mtime(self, rel_path: str) -> float:
+        """ファイルの更新日時を取得（存在しない場合は 0）"""
+        try:
+            return os.path.getmtime(os.path.join(self.project_dir, rel_path))
+        except OSError:
+            return 0.0
+
+    def rank_files(self, blocks: List[Tuple[str, str]]) -> List[Dict]:
+        """merge.txtのファイルブロックを重要度順に並べる
+
+        候補はmerge.txtに含まれるファイルのみとし、ディスクは更新日時の取得にのみ使用する。
+        """
+        files = [
+            {
+                'rel_path': rel_path,
+                'content': content,
+                'tokens': utils.estimate_tokens(utils.format_file_block(rel_path, content)),
+                'mtime': self._get_mtime(rel_path),
+                'order': order
+            }
+            for order, (rel_path, content) in enumerate(blocks)
+        ]
+        if not files:
+            return []
+
+        graph = build_import_graph({item['rel_path']: item['content'] for item in files})
+        importers = count_importers(graph)
+
+        # 更新が新しいほど高くなる順位スコア（0〜1）
+        by_mtime = sorted(files, key=lambda x: x['mtime'])
+        recency = {item['rel_path']: (i + 1) / len(by_mtime) for i, item in enumerate(by_mtime)}
+
+        for item in files:
+            rel_path = item['rel_path']
+            score = 3.0 * importers.get(rel_path, 0)
+            if os.path.basename(rel_path) in ENTRY_POINT_NAMES:
+                score += 5.0
+            score += 2.0 * recency[rel_path]
+            # 大きいファイルほど実装の比重が高いが、対数で頭打ちにする
+            score += min(math.log10(item['tokens'] + 1) / 4, 1.0)
+            item['score'] = round(score, 3)
+
+        return sorted(files, key=lambda x: (-x['score'], x['rel_path']))
+
+    def plan(self, stage: str, merge_content: str, reserved_tokens: int = 0) -> Optional[BudgetPlan]:
+        """merge.txtの内容から予算内に収まるファイルを選定（予算未設定の場合は None）"""
+        budget = self.get_budget(stage)
+        if budget <= 0:
+            return None
+
+        preamble, blocks = utils.split_file_blocks(merge_content)
+        if not blocks:
+            logger.warning(f"No file blocks found in merged content for {stage}")
+            return None
+
+        # ディレクトリ構造は常に含める
+        available = budget - reserved_tokens - utils.estimate_tokens(preamble)
+        selected, omitted = [], []
+        for item in self.rank_files(blocks):
+            # 省略一覧の1行分も見込んでおく
+            if item['tokens'] <= available - utils.estimate_tokens(item['rel_path']) - 8:
+                selected.append(item)
+                available -= item['tokens']
+            else:
+                omitted.append(item)
+                available -= utils.estimate_tokens(item['rel_path']) + 8
+
+        logger.info(
+            f"Token budget plan for {stage}: {len(selected)} files selected, "
+            f"{len(omitted)} omitted (budget: {budget}, reserved: {reserved_tokens})"
+        )
+        return BudgetPlan(stage, budget, selected, omitted, preamble)
+
+def available_code_tokens(settings: dict, stage: str, reserved_tokens: int = 0) -> int:
+    """プロンプトのコード部分に使えるトークン数を取得（0 は無制限）"""
+    budget = TokenBudgetPlanner(settings).get_budget(stage)
+    if budget <= 0:
+        return 0
+    return max(budget - reserved_tokens, 1)
+
+def fit_code_to_budget(settings: dict, stage: str, merge_content: str,
+                       reserved_tokens: int = 0) -> Tuple[str, str]:
+    """merge.txtの内容を予算内に収める
+
+    Returns:
+        (プロンプトに使うコード, 出力に付記する省略ファイル一覧)
+    """
+    planner = TokenBudgetPlanner(settings)
+    budget = planner.get_budget(stage)
+    if budget <= 0 or utils.estimate_tokens(merge_content) + reserved_tokens <= budget:
+        return merge_content, ""
+
+    plan = planner.plan(stage, merge_content, reserved_tokens)
+    if plan is None:
+        return merge_content, ""
+    return plan.render_code(), plan.omitted_notice()
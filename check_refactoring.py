@@ -2,7 +2,14 @@ import os
 import logging
 from typing import Optional, Dict, List
 from openai import OpenAI
-from utils import read_settings, read_file_safely, write_file_content
+from utils import read_settings, read_file_safely, write_file_content, estimate_tokens, get_int_setting
+from budget_planner import fit_code_to_budget, available_code_tokens
+from section_repair import SectionRepairer, find_incomplete_sections
+from merge_files import PythonFileMerger
+from git_delta import build_signature_context
+from code_index import build_focused_context
+from llm_client import ModelRouter, ResponseCache, request_chat
+from prompt_builder import build_user_prompt, build_messages
 
 # モジュール固有のロガーを設定
 logger = logging.getLogger(__name__)
@@ -10,16 +17,50 @@ logger = logging.getLogger(__name__)
 class RefactoringChecker:
     """コードのリファクタリング提案を管理するクラス"""
 
-    def __init__(self):
-        """設定を読み込んで初期化"""
+    ROLE_DESCRIPTION = ("あなたは経験豊富なソフトウェアエンジニアです。"
+                        "コードの品質を分析し、具体的で実践的なリファクタリング提案を提供することができます。"
+                        "SOLID原則やクリーンコードの原則に基づいた改善提案を行います。")
+
+    # リファクタリング提案に必要なセクション（先頭は文書タイトル）
+    REQUIRED_SECTIONS = [
+        "リファクタリング提案:",
+        "### 1. 単一責任原則に基づいた責任の分離",
+        "### 2. 関数の重複",
+        "### 3. 未使用の関数",
+        "### 4. 外部ファイルからの読み込み該当の関数",
+        "### 5. 過度なエラーログの抑制"
+    ]
+
+    # 観点ごとに関連コードを検索するクエリ（未使用の関数はシグネチャ一覧で判断する）
+    SECTION_QUERIES = {
+        "1. 単一責任原則に基づいた責任の分離": "init process generate settings client read write validate",
+        "2. 関数の重複": "read settings prompt response generate format",
+        "4. 外部ファイルからの読み込み該当の関数": "open read load file configparser json yaml csv path encoding",
+        "5. 過度なエラーログの抑制": "logger error warning exception except traceback"
+    }
+
+    def __init__(self, settings: Optional[dict] = None, client: Optional[OpenAI] = None,
+                 response_cache: Optional[ResponseCache] = None):
+        """設定を読み込んで初期化
+
+        Args:
+            settings (Optional[dict]): 指定した場合は設定ファイルを読まずにこの設定を使用
+            client (Optional[OpenAI]): 再利用するOpenAIクライアント
+            response_cache (Optional[ResponseCache]): AI応答のキャッシュ
+        """
         try:
-            self.settings = read_settings()
-            self.model = self.settings['openai_model']        # キー名を変更
+            self.settings = settings if settings is not None else read_settings()
+            self.response_cache = response_cache
+            self.router = ModelRouter(self.settings)
+            self.model = self.router.model_for('refactoring')
             self.temperature = float(0.7)  # 固定値として設定
             self.output_dir = os.path.join(self.settings['source_directory'], 'document')  # 出力ディレクトリのパスを修正
+            self.max_repair_attempts = get_int_setting(self.settings, 'max_repair_attempts', 2)
+            self.retrieval_top_k = get_int_setting(self.settings, 'retrieval_top_k', 0)
+            self.repair_metrics: Dict[str, int] = {}
             
-            # OpenAIクライアントを初期化
-            self.client = OpenAI(api_key=self.settings['openai_api_key'])
+            # OpenAIクライアントを初期化（指定されたものがあれば再利用）
+            self.client = client or OpenAI(api_key=self.settings['openai_api_key'])
             
             logger.info("RefactoringChecker initialized successfully")
         except Exception as e:
@@ -40,9 +81,40 @@ class RefactoringChecker:
             logger.error(f"Error reading merge file: {e}")
             return None
 
-    def _generate_prompt(self, code_content: str) -> str:
-        """AIに送信するプロンプトを生成"""
-        return f"""以下のPythonコードに対するリファクタリング提案を行ってください。
+    def _read_delta_content(self, delta_path: str, changed_files: List[str]) -> Optional[str]:
+        """差分マージと未変更モジュールのシグネチャを読み込む
+
+        Args:
+            changed_files (List[str]): 差分マージの作成時に対象とした変更ファイル
+        """
+        try:
+            if not changed_files:
+                logger.warning("No changed Python files to check")
+                return None
+            delta_content = read_file_safely(delta_path)
+            if delta_content is None:
+                logger.error(f"Failed to read {delta_path}")
+                return None
+
+            project_dir = os.path.abspath(self.settings['source_directory'])
+            exclude_patterns = [
+                pattern.strip() for pattern in self.settings['exclusions'].split(',')
+                if pattern.strip()
+            ]
+
+            # 未変更のモジュールはシグネチャのみを文脈として渡す
+            signature_context = build_signature_context(project_dir, exclude_patterns, changed_files)
+            logger.info(f"Successfully read delta merge for {len(changed_files)} changed files")
+            return f"{delta_content}\n{signature_context}"
+        except Exception as e:
+            logger.error(f"Error reading delta content: {e}")
+            return None
+
+    @staticmethod
+    def _generate_prompt(code_content: str) -> str:
+        """AIに送信するプロンプトを生成（コードを先頭に置き、指示を後ろに続ける）"""
+        instructions = f"""{RefactoringChecker.ROLE_DESCRIPTION}
+上記のPythonコードに対するリファクタリング提案を行ってください。
 以下の観点から分析し、具体的な改善提案を日本語で作成してください：
 
 1. 単一責任原則に基づいた責任の分離
@@ -69,40 +141,61 @@ class RefactoringChecker:
 [具体的な提案内容]
 
 ### 5. 過度なエラーログの抑制
-[具体的な提案内容]
+[具体的な提案内容]"""
+        return build_user_prompt(code_content, instructions)
 
-コード：
-{code_content}"""
-
-    def _get_ai_response(self, prompt: str) -> Optional[str]:
+    def _get_ai_response(self, prompt: str, task: str = 'generate') -> Optional[str]:
         """OpenAI APIを使用してリファクタリング提案を生成"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "あなたは経験豊富なソフトウェアエンジニアです。"
-                                 "コードの品質を分析し、具体的で実践的なリファクタリング提案を提供することができます。"
-                                 "SOLID原則やクリーンコードの原則に基づいた改善提案を行います。"
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=self.temperature
+            content = request_chat(
+                self.client, self.router.model_for('refactoring', task),
+                build_messages(prompt), self.temperature, 'refactoring', task,
+                cache=self.response_cache,
+                # 必要なセクションが揃った応答のみを再利用する
+                validate=lambda content: not find_incomplete_sections(content, self.REQUIRED_SECTIONS)
             )
             logger.info("Successfully received AI response")
-            return response.choices[0].message.content
+            return content
         except Exception as e:
             logger.error(f"Error getting AI response: {e}")
             return None
 
-    def generate_suggestions(self) -> Optional[str]:
-        """リファクタリング提案を生成してファイルに保存"""
+    def generate_suggestions(self, delta_path: Optional[str] = None,
+                             changed_files: Optional[List[str]] = None) -> Optional[str]:
+        """リファクタリング提案を生成してファイルに保存
+
+        Args:
+            delta_path (Optional[str]): 差分マージのパス。指定した場合は変更ファイルのみを対象とする
+            changed_files (Optional[List[str]]): 差分マージに含めた変更ファイルの一覧
+        """
         try:
-            # マージファイルを読み込み
-            code_content = self._read_merge_file()
-            if not code_content:
-                return None
+            if delta_path:
+                # 差分マージと未変更モジュールのシグネチャを読み込み
+                code_content = self._read_delta_content(delta_path, changed_files or [])
+                if not code_content:
+                    return None
+                omitted_notice = ""
+            else:
+                # 観点ごとの関連コードのみを予算内で抽出（失敗時は全コードを送信）
+                code_content = None
+                omitted_notice = ""
+                reserved_tokens = estimate_tokens(self._generate_prompt(''))
+                if self.retrieval_top_k > 0:
+                    code_content = build_focused_context(
+                        self.settings, self.SECTION_QUERIES, self.retrieval_top_k,
+                        max_tokens=available_code_tokens(self.settings, 'refactoring', reserved_tokens)
+                    )
+
+                if not code_content:
+                    # マージファイルを読み込み
+                    code_content = self._read_merge_file()
+                    if not code_content:
+                        return None
+
+                    # トークン予算を超える場合は重要度の高いファイルに絞り込む
+                    code_content, omitted_notice = fit_code_to_budget(
+                        self.settings, 'refactoring', code_content, reserved_tokens=reserved_tokens
+                    )
 
             # プロンプトを生成
             prompt = self._generate_prompt(code_content)
@@ -112,8 +205,14 @@ class RefactoringChecker:
             if not suggestions:
                 return None
 
+            # 欠落・空のセクションのみを追加で生成して差し込む
+            suggestions = self._repair_sections(suggestions, code_content)
+            if omitted_notice:
+                suggestions += f"\n\n{omitted_notice}"
+
             # リファクタリング提案を保存
-            output_path = os.path.join(self.output_dir, 'check_refactoring.txt')
+            output_name = 'check_refactoring_delta.txt' if delta_path else 'check_refactoring.txt'
+            output_path = os.path.join(self.output_dir, output_name)
             if write_file_content(output_path, suggestions):
                 logger.info(f"Successfully wrote refactoring suggestions to {output_path}")
                 return output_path
@@ -123,6 +222,15 @@ class RefactoringChecker:
             logger.error(f"Error generating refactoring suggestions: {e}")
             return None
 
+    def _repair_sections(self, suggestions: str, code_content: str) -> str:
+        """欠落したセクションを再生成して補完"""
+        repairer = SectionRepairer(
+            self.REQUIRED_SECTIONS, lambda prompt: self._get_ai_response(prompt, task='repair'),
+            self.max_repair_attempts
+        )
+        suggestions, self.repair_metrics = repairer.repair(suggestions, code_content)
+        return suggestions
+
     def validate_suggestions(self, suggestions_path: str) -> bool:
         """生成されたリファクタリング提案の妥当性を検証"""
         try:
@@ -131,20 +239,12 @@ class RefactoringChecker:
                 logger.error("Generated refactoring suggestions are empty")
                 return False
 
-            # 必要なセクションの存在を確認
-            required_sections = [
-                "リファクタリング提案:",
-                "### 1. 単一責任原則に基づいた責任の分離",
-                "### 2. 関数の重複",
-                "### 3. 未使用の関数",
-                "### 4. 外部ファイルからの読み込み該当の関数",
-                "### 5. 過度なエラーログの抑制"
-            ]
-
-            for section in required_sections:
-                if section not in content:
-                    logger.error(f"Missing required section: {section}")
-                    return False
+            # 必要なセクションが存在し、内容が空でないことを確認
+            incomplete = find_incomplete_sections(content, self.REQUIRED_SECTIONS)
+            if incomplete:
+                for section in incomplete:
+                    logger.error(f"Missing or empty required section: {section}")
+                return False
 
             logger.info("Refactoring suggestions validation successful")
             return True
@@ -153,11 +253,26 @@ class RefactoringChecker:
             logger.error(f"Error validating refactoring suggestions: {e}")
             return False
 
-def generate_refactoring_suggestions() -> Optional[str]:
-    """既存のコードとの互換性のための関数"""
+def generate_refactoring_suggestions(base_ref: Optional[str] = None, settings: Optional[dict] = None,
+                                     client: Optional[OpenAI] = None,
+                                     response_cache: Optional[ResponseCache] = None) -> Optional[str]:
+    """既存のコードとの互換性のための関数
+
+    Args:
+        base_ref (Optional[str]): 指定した場合、このgit参照以降の変更ファイルのみをチェック
+    """
     try:
-        checker = RefactoringChecker()
-        suggestions_path = checker.generate_suggestions()
+        checker = RefactoringChecker(settings, client, response_cache)
+        if base_ref:
+            # 差分マージを作成し、同じ変更ファイルの一覧で未変更モジュールのシグネチャを作る
+            merger = PythonFileMerger(settings=checker.settings)
+            delta_path = merger.process_delta(base_ref)
+            if not delta_path:
+                logger.error("Delta merge failed")
+                return None
+            suggestions_path = checker.generate_suggestions(delta_path, merger.changed_files)
+        else:
+            suggestions_path = checker.generate_suggestions()
         
         if suggestions_path and checker.validate_suggestions(suggestions_path):
             logger.info("Refactoring check completed successfully")
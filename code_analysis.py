@@ -0,0 +1,160 @@
+import os
+import ast
+import logging
+from typing import Dict, List, Set
+
+# モジュール固有のロガーを設定
+logger = logging.getLogger(__name__)
+
+def parse_source(source: str, filename: str = '<unknown>') -> ast.Module:
+    """ソースコードをASTに変換（構文エラー時は空のモジュール）"""
+    try:
+        return ast.parse(source, filename=filename)
+    except (SyntaxError, ValueError) as e:
+        logger.warning(f"Failed to parse {filename}: {e}")
+        return ast.Module(body=[], type_ignores=[])
+
+def module_name_from_path(rel_path: str) -> str:
+    """相対パスからモジュール名を生成（例: pkg/mod.py -> pkg.mod）"""
+    name = os.path.splitext(rel_path.replace('\\', '/'))[0].replace('/', '.')
+    if name.endswith('.__init__'):
+        name = name[:-len('.__init__')]
+    return name
+
+def extract_imports(source: str, filename: str = '<unknown>') -> Set[str]:
+    """import文で参照されているモジュール名を抽出"""
+    imports = set()
+    for node in ast.walk(parse_source(source, filename)):
+        if isinstance(node, ast.Import):
+            imports.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            imports.add(node.module)
+            # from pkg import mod 形式のサブモジュール参照も候補に含める
+            imports.update(f"{node.module}.{alias.name}" for alias in node.names)
+    return imports
+
+def build_import_graph(sources: Dict[str, str]) -> Dict[str, Set[str]]:
+    """プロジェクト内のimport関係を取得（相対パス -> 参照先の相対パス集合）"""
+    modules: Dict[str, str] = {}
+    for rel_path in sources:
+        module = module_name_from_path(rel_path)
+        modules[module] = rel_path
+        # フラットなスクリプト構成でも解決できるよう末尾名でも登録
+        modules.setdefault(module.split('.')[-1], rel_path)
+
+    graph: Dict[str, Set[str]] = {}
+    for rel_path, source in sources.items():
+        targets = set()
+        for name in extract_imports(source, rel_path):
+            target = modules.get(name)
+            if target and target != rel_path:
+                targets.add(target)
+        graph[rel_path] = targets
+    return graph
+
+def count_importers(graph: Dict[str, Set[str]]) -> Dict[str, int]:
+    """各ファイルを参照しているファイル数（入次数）を集計"""
+    counts = {rel_path: 0 for rel_path in graph}
+    for targets in graph.values():
+        for target in targets:
+            counts[target] = counts.get(target, 0) + 1
+    return counts
+
+def _format_function_signature(node: ast.AST, indent: str = '') -> str:
+    """関数定義のシグネチャを文字列化"""
+    prefix = 'async def' if isinstance(node, ast.AsyncFunctionDef) else 'def'
+    signature = f"{indent}{prefix} {node.name}({ast.unparse(node.args)})"
+    if node.returns is not None:
+        signature += f" -> {ast.unparse(node.returns)}"
+    return signature + ": ..."
+
+def extract_signatures(source: str, filename: str = '<unknown>') -> List[str]:
+    """トップレベルの関数・クラス（メソッドを含む）のシグネチャを抽出"""
+    signatures = []
+    for node in parse_source(source, filename).body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            signatures.append(_format_function_signature(node))
+        elif isinstance(node, ast.ClassDef):
+            bases = ', '.join(ast.unparse(base) for base in node.bases)
+            signatures.append(f"class {node.name}({bases}):" if bases else f"class {node.name}:")
+            methods = [
+                _format_function_signature(child, '    ')
+                for child in node.body
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))
+            ]
+            signatures.extend(methods or ['    ...'])
+    return signatures
+
+class _CallCollector(ast.NodeVisitor):
+    """関数内で参照されている識別子と呼び出し先を収集"""
+
+    def __init__(self):
+        self.identifiers: List[str] = []
+        self.calls: List[str] = []
+
+    def visit_Name(self, node: ast.Name):
+        self.identifiers.append(node.id)
+
+    def visit_Attribute(self, node: ast.Attribute):
+        self.identifiers.append(node.attr)
+        self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call):
+        try:
+            self.calls.append(ast.unparse(node.func))
+        except Exception:
+            pass
+        self.generic_visit(node)
+
+def _make_code_unit(node: ast.AST, source: str, rel_path: str, qualname: str, kind: str) -> Dict:
+    """関数・クラスのノードからコード単位の情報を作成"""
+    collector = _CallCollector()
+    collector.visit(node)
+    if kind == 'class':
+        bases = ', '.join(ast.unparse(base) for base in node.bases)
+        signature = f"class {node.name}({bases}):" if bases else f"class {node.name}:"
+    else:
+        signature = _format_function_signature(node)
+    return {
+        'id': f"{rel_path}::{qualname}",
+        'file': rel_path,
+        'name': node.name,
+        'qualname': qualname,
+        'kind': kind,
+        'lineno': node.lineno,
+        'signature': signature,
+        'docstring': ast.get_docstring(node) or '',
+        'identifiers': sorted(set(collector.identifiers)),
+        'calls': sorted(set(collector.calls)),
+        'source': ast.get_source_segment(source, node) or ''
+    }
+
+def extract_code_units(source: str, rel_path: str) -> List[Dict]:
+    """トップレベルの関数・クラスとメソッドをコード単位として抽出"""
+    units = []
+    for node in parse_source(source, rel_path).body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            units.append(_make_code_unit(node, source, rel_path, node.name, 'function'))
+        elif isinstance(node, ast.ClassDef):
+            class_unit = _make_code_unit(node, source, rel_path, node.name, 'class')
+            # クラス単位では本文と参照をメソッドに委ね、シグネチャのみを保持
+            class_unit.update(source=class_unit['signature'], identifiers=[], calls=[])
+            units.append(class_unit)
+            for child in node.body:
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    units.append(_make_code_unit(
+                        child, source, rel_path, f"{node.name}.{child.name}", 'method'
+                    ))
+    return units
+
+def extract_symbols(source: str, rel_path: str) -> List[Dict]:
+    """関数・クラス・メソッドの名前と位置の一覧を抽出"""
+    return [
+        {
+            'name': unit['qualname'],
+            'kind': unit['kind'],
+            'lineno': unit['lineno'],
+            'signature': unit['signature']
+        }
+        for unit in extract_code_units(source, rel_path)
+    ]
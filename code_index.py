@@ -0,0 +1,237 @@
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import utils
+from code_analysis import extract_code_units
+
+# モジュール固有のロガーを設定
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'code_index.json'
+INDEX_VERSION = 1
+
+# BM25のパラメータ
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 検索に寄与しない語
+STOPWORDS = {'self', 'cls', 'the', 'and', 'for', 'none', 'true', 'false', 'str', 'int', 'dict', 'list'}
+
+IDENTIFIER_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|[^\x00-\x7f]+')
+CAMEL_PATTERN = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+')
+
+def tokenize(text: str) -> List[str]:
+    """識別子・文章を検索用の語に分割
+
+    snake_case / CamelCase は構成語に分割し、元の識別子も残す。
+    日本語などの非ASCII文字列は文字バイグラムに分割する。
+    """
+    terms = []
+    for word in IDENTIFIER_PATTERN.findall(text or ''):
+        if word.isascii():
+            lowered = word.lower().strip('_')
+            if len(lowered) > 1 and lowered not in STOPWORDS:
+                terms.append(lowered)
+            parts = [p.lower() for part in word.split('_') for p in CAMEL_PATTERN.findall(part)]
+            if len(parts) > 1:
+                terms.extend(p for p in parts if len(p) > 1 and p not in STOPWORDS)
+        elif len(word) == 1:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+def _unit_terms(unit: Dict) -> Dict[str, int]:
+    """コード単位の語頻度を作成（名前と呼び出し先は重みを上げる）"""
+    counts = Counter()
+    counts.update(tokenize(unit['qualname']) * 3)
+    counts.update(tokenize(unit['docstring']))
+    counts.update(tokenize(' '.join(unit['identifiers'])))
+    counts.update(tokenize(' '.join(unit['calls'])) * 2)
+    return dict(counts)
+
+class CodeIndex:
+    """関数・クラス単位のBM25転置インデックス
+
+    document/code_index.json に永続化し、内容が変わったファイルのみを再解析する。
+    """
+
+    def __init__(self, document_dir: str):
+        self.path = os.path.join(document_dir, INDEX_FILENAME)
+        self.files: Dict[str, Dict] = self._load()
+        self._build_postings()
+
+    def _load(self) -> Dict[str, Dict]:
+        """永続化されたインデックスを読み込む"""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            data = json.loads(utils.read_file_safely(self.path) or '{}')
+            if data.get('version') != INDEX_VERSION:
+                logger.info("Code index version changed, rebuilding")
+                return {}
+            return data.get('files', {})
+        except ValueError as e:
+            logger.warning(f"Ignoring invalid code index {self.path}: {e}")
+            return {}
+
+    def save(self) -> bool:
+        """インデックスを書き込む"""
+        content = json.dumps({'version': INDEX_VERSION, 'files': self.files}, ensure_ascii=False)
+        return utils.write_file_content(self.path, content)
+
+    def _build_postings(self) -> None:
+        """語ごとの出現コード単位（転置リスト）と文書長を作成"""
+        self.units: Dict[str, Dict] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        for entry in self.files.values():
+            for unit in entry['units']:
+                self.units[unit['id']] = unit
+                for term, count in unit['terms'].items():
+                    self.postings.setdefault(term, {})[unit['id']] = count
+        self.doc_lengths = {uid: sum(unit['terms'].values()) for uid, unit in self.units.items()}
+        self.avg_length = (sum(self.doc_lengths.values()) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+    def update(self, project_dir: str, exclude_patterns: List[str]) -> int:
+        """変更されたファイルのみを再解析してインデックスを更新
+
+        Returns:
+            再解析したファイル数
+        """
+        current = {}
+        updated = 0
+        for rel_path, filepath in utils.get_python_files(project_dir, exclude_patterns):
+            rel_path = utils.normalize_path(rel_path)
+            content = utils.read_file_safely(filepath)
+            if content is None:
+                continue
+            digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+            entry = self.files.get(rel_path)
+            if entry is None or entry['hash'] != digest:
+                units = extract_code_units(content, rel_path)
+                for unit in units:
+                    unit['terms'] = _unit_terms(unit)
+                entry = {'hash': digest, 'units': units}
+                updated += 1
+            current[rel_path] = entry
+
+        removed = len(set(self.files) - set(current))
+        self.files = current
+        self._build_postings()
+        if updated or removed:
+            self.save()
+        logger.info(
+            f"Code index updated: {updated} files reindexed, {removed} removed, "
+            f"{len(self.units)} code units"
+        )
+        return updated
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[Dict, float]]:
+        """クエリに関連するコード単位をBM25スコア順に取得"""
+        scores: Dict[str, float] = {}
+        total = len(self.units)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for uid, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[uid] / (self.avg_length or 1))
+                scores[uid] = scores.get(uid, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:top_k]
+        return [(self.units[uid], score) for uid, score in ranked]
+
+    def signature_overview(self) -> str:
+        """全コード単位のシグネチャ一覧を作成"""
+        sections = []
+        for rel_path in sorted(self.files):
+            signatures = [
+                ('    ' if unit['kind'] == 'method' else '') + unit['signature']
+                for unit in self.files[rel_path]['units']
+            ]
+            if signatures:
+                sections.append(f"## {rel_path}\n" + "\n".join(signatures))
+        return "\n\n".join(sections)
+
+def _format_unit(unit: Dict) -> str:
+    """コード単位をmerge.txt形式のブロックに変換"""
+    return utils.format_file_block(f"{unit['file']} ({unit['qualname']}, line {unit['lineno']})", unit['source'])
+
+def _omitted_notice(count: int) -> str:
+    """予算により省略したコード単位の注記"""
+    return f"\n(トークン予算により関連度の低いコード単位 {count} 件を省略)\n"
+
+def build_focused_context(settings: dict, section_queries: Dict[str, str], top_k: int,
+                          max_tokens: int = 0) -> Optional[str]:
+    """観点ごとに関連するコード単位のみを抜き出したコンテキストを作成
+
+    Args:
+        max_tokens (int): コンテキストのトークン上限（0 は無制限）。超える場合は各観点の
+            下位のコード単位から省略し、シグネチャ一覧だけで超える場合は None を返す
+    """
+    try:
+        project_dir = os.path.abspath(settings['source_directory'])
+        exclude_patterns = [
+            pattern.strip() for pattern in settings['exclusions'].split(',')
+            if pattern.strip()
+        ]
+        index = CodeIndex(os.path.join(project_dir, 'document'))
+        index.update(project_dir, exclude_patterns)
+        if not index.units:
+            logger.warning("Code index is empty")
+            return None
+
+        overview = "# コード概要（全関数・クラスのシグネチャ）\n\n" + index.signature_overview() + "\n"
+        results = {section: index.search(query, top_k) for section, query in section_queries.items()}
+
+        # 各観点の上位から順に（観点を交互に）予算内に収まるコード単位を選ぶ
+        available = max_tokens - utils.estimate_tokens(overview) if max_tokens > 0 else None
+        if available is not None:
+            available -= utils.estimate_tokens(_omitted_notice(sum(len(units) for units in results.values())))
+            available -= sum(utils.estimate_tokens(f"\n# 「{section}」に関連するコード\n") for section in results)
+            if available < 0:
+                logger.warning(f"Signature overview exceeds the token budget ({max_tokens} tokens)")
+                return None
+        selected = set()
+        for rank in range(max((len(units) for units in results.values()), default=0)):
+            for units in results.values():
+                if rank >= len(units):
+                    continue
+                unit = units[rank][0]
+                if unit['id'] in selected:
+                    # 既に選んだコード単位は再掲の注記のみ
+                    if available is not None:
+                        available -= utils.estimate_tokens(f"\n(再掲: {unit['id']})\n")
+                    continue
+                tokens = utils.estimate_tokens(_format_unit(unit))
+                if available is not None:
+                    if tokens > available:
+                        continue
+                    available -= tokens
+                selected.add(unit['id'])
+
+        content = overview
+        included = set()
+        omitted = 0
+        for section, units in results.items():
+            content += f"\n# 「{section}」に関連するコード\n"
+            for unit, score in units:
+                if unit['id'] not in selected:
+                    omitted += 1
+                elif unit['id'] in included:
+                    content += f"\n(再掲: {unit['id']})\n"
+                else:
+                    included.add(unit['id'])
+                    content += _format_unit(unit)
+        if omitted:
+            content += _omitted_notice(omitted)
+        logger.info(f"Built focused context with {len(included)} code units ({omitted} omitted by budget)")
+        return content
+    except Exception as e:
+        logger.error(f"Error building focused context: {e}")
+        return None
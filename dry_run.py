@@ -0,0 +1,204 @@
+import os
+import logging
+from typing import Dict, List, Optional, Tuple
+import utils
+from budget_planner import fit_code_to_budget, available_code_tokens
+from pipeline import PipelineRunner
+from generate_spec import SpecificationGenerator
+from generate_detailed_spec import DetailedSpecificationGenerator
+from check_refactoring import RefactoringChecker
+from code_index import build_focused_context
+from llm_client import ModelRouter
+from prompt_builder import COMMON_SYSTEM_PROMPT
+
+# モジュール固有のロガーを設定
+logger = logging.getLogger(__name__)
+
+class DryRunPlanner:
+    """API呼び出しを行わずに実行時のトークン数・コスト・所要時間を見積もるクラス"""
+
+    def __init__(self, runner: Optional[PipelineRunner] = None):
+        self.runner = runner or PipelineRunner()
+        self.settings = self.runner.settings
+        self.router = ModelRouter(self.settings)
+        self.input_cost = utils.get_float_setting(self.settings, 'input_cost_per_1k', 0.03)
+        self.output_cost = utils.get_float_setting(self.settings, 'output_cost_per_1k', 0.06)
+        self.context_window = utils.get_int_setting(self.settings, 'context_window', 8192)
+        self.expected_output = utils.get_int_setting(self.settings, 'expected_output_tokens', 2000)
+        self.output_tps = max(utils.get_float_setting(self.settings, 'output_tokens_per_second', 20), 0.1)
+        self.overhead = utils.get_float_setting(self.settings, 'request_overhead_seconds', 2)
+        self.rpm = utils.get_int_setting(self.settings, 'requests_per_minute', 60)
+        self.tpm = utils.get_int_setting(self.settings, 'tokens_per_minute', 0)
+        self.max_repair_attempts = utils.get_int_setting(self.settings, 'max_repair_attempts', 2)
+        self.model_pricing = self._parse_pricing(self.settings.get('model_pricing') or {})
+        self.model_context_windows = self._parse_context_windows(self.settings.get('model_context_windows') or {})
+
+    @staticmethod
+    def _parse_pricing(pricing: Dict[str, str]) -> Dict[str, Tuple[float, float]]:
+        """[PRICING] の「入力単価, 出力単価」をモデルごとに解析"""
+        parsed = {}
+        for model, value in pricing.items():
+            try:
+                input_cost, output_cost = (float(part) for part in value.split(','))
+                parsed[model.lower()] = (input_cost, output_cost)
+            except ValueError:
+                logger.warning(f"Invalid pricing for {model}: {value!r} (expected 'input, output')")
+        return parsed
+
+    def _prices_for(self, model: str) -> Tuple[float, float]:
+        """モデルの1000トークンあたりの入力・出力単価を取得（未設定は既定の単価）"""
+        return self.model_pricing.get(model.lower(), (self.input_cost, self.output_cost))
+
+    @staticmethod
+    def _parse_context_windows(windows: Dict[str, str]) -> Dict[str, int]:
+        """[CONTEXT_WINDOWS] のトークン数をモデルごとに解析"""
+        parsed = {}
+        for model, value in windows.items():
+            try:
+                parsed[model.lower()] = int(value)
+            except ValueError:
+                logger.warning(f"Invalid context window for {model}: {value!r} (expected an integer)")
+        return parsed
+
+    def _context_window_for(self, model: str) -> int:
+        """モデルのコンテキスト長を取得（未設定は既定の context_window）"""
+        return self.model_context_windows.get(model.lower(), self.context_window)
+
+    def _estimate_stage(self, stage: str, system_prompt: str, prompt: str, cached: bool) -> Dict:
+        """1ステージ分の見積もりを作成"""
+        prompt_tokens = utils.estimate_tokens(system_prompt) + utils.estimate_tokens(prompt)
+        output_tokens = self.expected_output
+        model = self.router.model_for(stage)
+        context_window = self._context_window_for(model)
+        estimate = {
+            'stage': stage,
+            'model': model,
+            'cached': cached,
+            'prompt_tokens': prompt_tokens,
+            'output_tokens': output_tokens,
+            'requests': 0 if cached else 1,
+            'cost': 0.0,
+            'latency': 0.0,
+            'context_window': context_window,
+            'exceeds_context': prompt_tokens + output_tokens > context_window
+        }
+        if not cached:
+            input_cost, output_cost = self._prices_for(model)
+            estimate['cost'] = prompt_tokens / 1000 * input_cost + output_tokens / 1000 * output_cost
+            estimate['latency'] = self.overhead + output_tokens / self.output_tps
+        return estimate
+
+    def estimate(self) -> Optional[List[Dict]]:
+        """各ステージの見積もりを作成（マージはローカルで実行またはキャッシュを利用）"""
+        merge_path = self.runner.run_merge_stage()
+        merge_content = utils.read_file_safely(merge_path) if merge_path else None
+        if not merge_content:
+            logger.error("Dry run aborted: merge.txt is not available")
+            return None
+
+        estimates = []
+
+        code, _ = fit_code_to_budget(
+            self.settings, 'spec', merge_content,
+            reserved_tokens=utils.estimate_tokens(SpecificationGenerator._generate_prompt(''))
+        )
+        estimates.append(self._estimate_stage(
+            'spec', COMMON_SYSTEM_PROMPT,
+            SpecificationGenerator._generate_prompt(code), self.runner.is_stage_fresh('spec')
+        ))
+
+        # 仕様書が未生成の場合は想定出力トークン数の文章で代用
+        spec_path = os.path.join(self.runner.document_dir, 'requirements_spec.txt')
+        spec_content = utils.read_file_safely(spec_path) if estimates[0]['cached'] else None
+        if spec_content is None:
+            spec_content = 'x' * (self.expected_output * 4)
+        code, _ = fit_code_to_budget(
+            self.settings, 'detailed', merge_content,
+            reserved_tokens=utils.estimate_tokens(DetailedSpecificationGenerator._generate_prompt('', spec_content))
+        )
+        estimates.append(self._estimate_stage(
+            'detailed', COMMON_SYSTEM_PROMPT,
+            DetailedSpecificationGenerator._generate_prompt(code, spec_content),
+            estimates[0]['cached'] and self.runner.is_stage_fresh('detailed')
+        ))
+
+        code = None
+        reserved_tokens = utils.estimate_tokens(RefactoringChecker._generate_prompt(''))
+        top_k = utils.get_int_setting(self.settings, 'retrieval_top_k', 0)
+        if top_k > 0:
+            code = build_focused_context(
+                self.settings, RefactoringChecker.SECTION_QUERIES, top_k,
+                max_tokens=available_code_tokens(self.settings, 'refactoring', reserved_tokens)
+            )
+        if not code:
+            code, _ = fit_code_to_budget(self.settings, 'refactoring', merge_content, reserved_tokens=reserved_tokens)
+        estimates.append(self._estimate_stage(
+            'refactoring', COMMON_SYSTEM_PROMPT,
+            RefactoringChecker._generate_prompt(code), self.runner.is_stage_fresh('refactoring')
+        ))
+        return estimates
+
+    def project_latency(self, estimates: List[Dict]) -> float:
+        """レート制限を考慮した全体の所要時間を見積もる
+
+        PipelineRunner は各ステージを順に実行するため、所要時間は各ステージの合計となる。
+        """
+        total = sum(item['latency'] for item in estimates)
+
+        requests = sum(item['requests'] for item in estimates)
+        if self.rpm > 0 and requests > 1:
+            total = max(total, (requests - 1) * 60 / self.rpm)
+        if self.tpm > 0:
+            tokens = sum(item['prompt_tokens'] + item['output_tokens'] for item in estimates if item['requests'])
+            total = max(total, tokens / self.tpm * 60)
+        return total
+
+    def render_report(self, estimates: List[Dict]) -> str:
+        """見積もり結果をレポート形式で出力"""
+        lines = [
+            "# ドライラン見積もり（API呼び出しなし）",
+            f"既定のコンテキスト長: {self.context_window} tokens / "
+            f"RPM: {self.rpm or '無制限'} / TPM: {self.tpm or '無制限'}",
+            ""
+        ]
+        for item in estimates:
+            status = "スキップ（キャッシュ済み）" if item['cached'] else "実行"
+            line = (
+                f"- {item['stage']} ({item['model']}): {status}, 入力 約{item['prompt_tokens']} tokens, "
+                f"出力 約{item['output_tokens']} tokens, 約${item['cost']:.4f}, 約{item['latency']:.1f}秒"
+            )
+            if item['exceeds_context']:
+                line += f" [警告: コンテキスト長 {item['context_window']} tokens を超過]"
+            lines.append(line)
+
+        requests = sum(item['requests'] for item in estimates)
+        cost = sum(item['cost'] for item in estimates)
+        # セクション修復は最大で各ステージ max_repair_attempts 回の追加リクエスト
+        repair_requests = sum(
+            self.max_repair_attempts for item in estimates
+            if item['requests'] and item['stage'] in ('detailed', 'refactoring')
+        )
+        lines.extend([
+            "",
+            f"リクエスト数: {requests}（セクション修復で最大 {repair_requests} 件追加）",
+            f"推定コスト: 約${cost:.4f}",
+            f"推定所要時間: 約{self.project_latency(estimates):.1f}秒"
+        ])
+        exceeded = [item['stage'] for item in estimates if item['exceeds_context']]
+        if exceeded:
+            lines.append(f"コンテキスト長を超過するステージ: {', '.join(exceeded)}（[BUDGET] の設定を検討してください）")
+        return "\n".join(lines) + "\n"
+
+def run_dry_run() -> Optional[str]:
+    """ドライランのエントリーポイント"""
+    try:
+        planner = DryRunPlanner()
+        estimates = planner.estimate()
+        if estimates is None:
+            return None
+        report = planner.render_report(estimates)
+        logger.info(f"Dry run estimate completed for {len(estimates)} stages")
+        return report
+    except Exception as e:
+        logger.error(f"Error in dry run: {e}")
+        return None
@@ -2,7 +2,11 @@ import os
 import logging
 from typing import Optional, Dict, List, Tuple
 from openai import OpenAI
-from utils import read_settings, read_file_safely, write_file_content
+from utils import read_settings, read_file_safely, write_file_content, estimate_tokens, get_int_setting
+from budget_planner import fit_code_to_budget
+from section_repair import SectionRepairer, find_incomplete_sections
+from llm_client import ModelRouter, ResponseCache, request_chat
+from prompt_builder import build_user_prompt, build_messages
 
 # モジュール固有のロガーを設定
 logger = logging.getLogger(__name__)
@@ -10,17 +14,42 @@ logger = logging.getLogger(__name__)
 class DetailedSpecificationGenerator:
     """詳細仕様書生成を管理するクラス"""
 
-    def __init__(self):
-        """設定を読み込んで初期化"""
+    ROLE_DESCRIPTION = ("あなたは優秀なソフトウェアアーキテクトです。コードと仕様書を解析して、"
+                        "実装の詳細まで踏み込んだ包括的なプログラム仕様書を作成することができます。")
+
+    # 詳細仕様書に必要なセクション（先頭は文書タイトル）
+    REQUIRED_SECTIONS = [
+        "# プログラム仕様書",
+        "## 1. システム概要",
+        "## 2. ファイルごとの役割と詳細説明",
+        "## 3. 関数ごとの役割と詳細説明",
+        "## 4. 非機能要件",
+        "## 5. 技術要件",
+        "## 6. 使用手順と注意事項"
+    ]
+
+    def __init__(self, settings: Optional[dict] = None, client: Optional[OpenAI] = None,
+                 response_cache: Optional[ResponseCache] = None):
+        """設定を読み込んで初期化
+
+        Args:
+            settings (Optional[dict]): 指定した場合は設定ファイルを読まずにこの設定を使用
+            client (Optional[OpenAI]): 再利用するOpenAIクライアント
+            response_cache (Optional[ResponseCache]): AI応答のキャッシュ
+        """
         try:
-            self.settings = read_settings()
-            self.model = self.settings['openai_model']
+            self.settings = settings if settings is not None else read_settings()
+            self.response_cache = response_cache
+            self.router = ModelRouter(self.settings)
+            self.model = self.router.model_for('detailed')
             self.temperature = float(0.7)  # 固定値として設定
             self.source_dir = self.settings['source_directory']
             self.output_dir = os.path.join(self.source_dir, 'document')
+            self.max_repair_attempts = get_int_setting(self.settings, 'max_repair_attempts', 2)
+            self.repair_metrics: Dict[str, int] = {}
             
-            # OpenAIクライアントを初期化
-            self.client = OpenAI(api_key=self.settings['openai_api_key'])
+            # OpenAIクライアントを初期化（指定されたものがあれば再利用）
+            self.client = client or OpenAI(api_key=self.settings['openai_api_key'])
             
             logger.info("DetailedSpecificationGenerator initialized successfully")
         except Exception as e:
@@ -51,9 +80,11 @@ class DetailedSpecificationGenerator:
             logger.error(f"Error reading input files: {e}")
             return None
 
-    def _generate_prompt(self, merge_content: str, spec_content: str) -> str:
-        """AIに送信するプロンプトを生成"""
-        return f"""以下の機能要件仕様書とソースコードを基に、より詳細なプログラム仕様書を作成してください。
+    @staticmethod
+    def _generate_prompt(merge_content: str, spec_content: str) -> str:
+        """AIに送信するプロンプトを生成（コードを先頭に置き、仕様書と指示を後ろに続ける）"""
+        instructions = f"""{DetailedSpecificationGenerator.ROLE_DESCRIPTION}
+上記のソースコードと以下の機能要件仕様書を基に、より詳細なプログラム仕様書を作成してください。
 出力は以下の形式に従い、具体的な実装詳細、データフロー、各モジュールの相互作用を含めてください：
 
 # プログラム仕様書
@@ -77,28 +108,21 @@ class DetailedSpecificationGenerator:
 [セットアップ手順、使用方法、既知の制限事項]
 
 機能要件仕様書：
-{spec_content}
+{spec_content}"""
+        return build_user_prompt(merge_content, instructions)
 
-ソースコード：
-{merge_content}"""
-
-    def _get_ai_response(self, prompt: str) -> Optional[str]:
+    def _get_ai_response(self, prompt: str, task: str = 'generate') -> Optional[str]:
         """OpenAI APIを使用して詳細仕様書を生成"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "あなたは優秀なソフトウェアアーキテクトです。コードと仕様書を解析して、"
-                                 "実装の詳細まで踏み込んだ包括的なプログラム仕様書を作成することができます。"
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=self.temperature
+            content = request_chat(
+                self.client, self.router.model_for('detailed', task),
+                build_messages(prompt), self.temperature, 'detailed', task,
+                cache=self.response_cache,
+                # 必要なセクションが揃った応答のみを再利用する
+                validate=lambda content: not find_incomplete_sections(content, self.REQUIRED_SECTIONS)
             )
             logger.info("Successfully received AI response")
-            return response.choices[0].message.content
+            return content
         except Exception as e:
             logger.error(f"Error getting AI response: {e}")
             return None
@@ -113,6 +137,12 @@ class DetailedSpecificationGenerator:
                 
             merge_content, spec_content = input_contents
 
+            # トークン予算を超える場合は重要度の高いファイルに絞り込む
+            merge_content, omitted_notice = fit_code_to_budget(
+                self.settings, 'detailed', merge_content,
+                reserved_tokens=estimate_tokens(self._generate_prompt('', spec_content))
+            )
+
             # プロンプトを生成
             prompt = self._generate_prompt(merge_content, spec_content)
             
@@ -121,6 +151,11 @@ class DetailedSpecificationGenerator:
             if not specification:
                 return None
 
+            # 欠落・空のセクションのみを追加で生成して差し込む
+            specification = self._repair_sections(specification, merge_content, spec_content)
+            if omitted_notice:
+                specification += f"\n\n{omitted_notice}"
+
             # 詳細仕様書を保存
             output_path = os.path.join(self.output_dir, 'detailed_program_spec.txt')
             if write_file_content(output_path, specification):
@@ -132,6 +167,17 @@ class DetailedSpecificationGenerator:
             logger.error(f"Error generating detailed specification: {e}")
             return None
 
+    def _repair_sections(self, specification: str, merge_content: str, spec_content: str) -> str:
+        """欠落したセクションを再生成して補完"""
+        repairer = SectionRepairer(
+            self.REQUIRED_SECTIONS, lambda prompt: self._get_ai_response(prompt, task='repair'),
+            self.max_repair_attempts
+        )
+        specification, self.repair_metrics = repairer.repair(
+            specification, merge_content, f"機能要件仕様書：\n{spec_content}"
+        )
+        return specification
+
     def validate_specification(self, spec_path: str) -> bool:
         """生成された詳細仕様書の妥当性を検証"""
         try:
@@ -140,21 +186,12 @@ class DetailedSpecificationGenerator:
                 logger.error("Generated detailed specification is empty")
                 return False
 
-            # 必要なセクションの存在を確認
-            required_sections = [
-                "# プログラム仕様書",
-                "## 1. システム概要",
-                "## 2. ファイルごとの役割と詳細説明",
-                "## 3. 関数ごとの役割と詳細説明",
-                "## 4. 非機能要件",
-                "## 5. 技術要件",
-                "## 6. 使用手順と注意事項"
-            ]
-
-            for section in required_sections:
-                if section not in content:
-                    logger.error(f"Missing required section: {section}")
-                    return False
+            # 必要なセクションが存在し、内容が空でないことを確認
+            incomplete = find_incomplete_sections(content, self.REQUIRED_SECTIONS)
+            if incomplete:
+                for section in incomplete:
+                    logger.error(f"Missing or empty required section: {section}")
+                return False
 
             logger.info("Detailed specification validation successful")
             return True
@@ -163,10 +200,11 @@ class DetailedSpecificationGenerator:
             logger.error(f"Error validating detailed specification: {e}")
             return False
 
-def generate_detailed_specification() -> Optional[str]:
+def generate_detailed_specification(settings: Optional[dict] = None, client: Optional[OpenAI] = None,
+                                    response_cache: Optional[ResponseCache] = None) -> Optional[str]:
     """既存のコードとの互換性のための関数"""
     try:
-        generator = DetailedSpecificationGenerator()
+        generator = DetailedSpecificationGenerator(settings, client, response_cache)
         spec_path = generator.generate()
         
         if spec_path and generator.validate_specification(spec_path):
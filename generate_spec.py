@@ -2,7 +2,10 @@ import os
 import logging
 from typing import Optional
 from openai import OpenAI
-from utils import read_settings, read_file_safely, write_file_content
+from utils import read_settings, read_file_safely, write_file_content, estimate_tokens
+from budget_planner import fit_code_to_budget
+from llm_client import ModelRouter, ResponseCache, request_chat
+from prompt_builder import build_user_prompt, build_messages
 
 # ロガーの設定
 logger = logging.getLogger(__name__)
@@ -11,21 +14,33 @@ logging.basicConfig(level=logging.DEBUG)
 class SpecificationGenerator:
     """仕様書生成を管理するクラス"""
 
-    def __init__(self):
-        """設定を読み込んで初期化"""
+    ROLE_DESCRIPTION = "あなたは仕様書を作成するAIです。"
+
+    def __init__(self, settings: Optional[dict] = None, client: Optional[OpenAI] = None,
+                 response_cache: Optional[ResponseCache] = None):
+        """設定を読み込んで初期化
+
+        Args:
+            settings (Optional[dict]): 指定した場合は設定ファイルを読まずにこの設定を使用
+            client (Optional[OpenAI]): 再利用するOpenAIクライアント
+            response_cache (Optional[ResponseCache]): AI応答のキャッシュ
+        """
         try:
-            config = read_settings()
+            config = settings if settings is not None else read_settings()
+            self.settings = config
+            self.response_cache = response_cache
             # APIセクションから設定を読み込む
             self.api_key = config.get('openai_api_key', '')  # 設定キーを変更
-            self.model = config.get('openai_model', 'gpt-4')  # 設定キーを変更
+            self.router = ModelRouter(config)
+            self.model = self.router.model_for('spec')
             self.temperature = 0.7  # デフォルト値として設定
             
             # ソースディレクトリの設定
             self.source_dir = config.get('source_directory', '.')
             self.document_dir = os.path.join(self.source_dir, 'document')
 
-            # OpenAIクライアントを初期化
-            self.client = OpenAI(api_key=self.api_key)
+            # OpenAIクライアントを初期化（指定されたものがあれば再利用）
+            self.client = client or OpenAI(api_key=self.api_key)
 
             logger.debug(f"SpecificationGenerator initialized with model: {self.model}")
         except KeyError as e:
@@ -43,10 +58,18 @@ class SpecificationGenerator:
                 logger.error("コード内容が空です。")
                 return ""
 
+            # トークン予算を超える場合は重要度の高いファイルに絞り込む
+            code_content, omitted_notice = fit_code_to_budget(
+                self.settings, 'spec', code_content,
+                reserved_tokens=estimate_tokens(self._generate_prompt(''))
+            )
+
             prompt = self._generate_prompt(code_content)
             specification = self._get_ai_response(prompt)
             if not specification:
                 return ""
+            if omitted_notice:
+                specification += f"\n\n{omitted_notice}"
 
             # 出力先をdocumentフォルダに設定
             output_path = os.path.join(self.document_dir, 'requirements_spec.txt')
@@ -68,38 +91,35 @@ class SpecificationGenerator:
             logger.error("merge.txt の読み込みに失敗しました。")
         return content or ""
 
-    def _generate_prompt(self, code_content: str) -> str:
-        """AIに送信するプロンプトを生成"""
-        return f"""以下のPythonコードを解析して、日本語で機能要件仕様書を作成してください。
+    @staticmethod
+    def _generate_prompt(code_content: str) -> str:
+        """AIに送信するプロンプトを生成（コードを先頭に置き、指示を後ろに続ける）"""
+        instructions = f"""{SpecificationGenerator.ROLE_DESCRIPTION}
+上記のPythonコードを解析して、日本語で機能要件仕様書を作成してください。
 # AIチャットアプリケーション機能要件仕様書
 ## 1. システム概要
 ## 2. 主要機能要件
 ## 3. 非機能要件
-## 4. 技術要件
-
-コード:
-{code_content}"""
+## 4. 技術要件"""
+        return build_user_prompt(code_content, instructions)
 
     def _get_ai_response(self, prompt: str) -> str:
         """OpenAI APIを使用して仕様書を生成"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "あなたは仕様書を作成するAIです。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=self.temperature
+            content = request_chat(
+                self.client, self.model, build_messages(prompt), self.temperature, 'spec',
+                cache=self.response_cache
             )
             logger.info("AI応答の取得に成功しました。")
-            return response.choices[0].message.content
+            return content
         except Exception as e:
             logger.error(f"AI応答取得中にエラーが発生しました: {e}")
             return ""
 
-def generate_specification() -> str:
+def generate_specification(settings: Optional[dict] = None, client: Optional[OpenAI] = None,
+                           response_cache: Optional[ResponseCache] = None) -> str:
     """generate_specification 関数"""
-    generator = SpecificationGenerator()
+    generator = SpecificationGenerator(settings, client, response_cache)
     return generator.generate()
 
 if __name__ == "__main__":
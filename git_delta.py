@@ -0,0 +1,89 @@
+import logging
+import subprocess
+from typing import List, Optional
+import utils
+from code_analysis import extract_signatures
+
+# モジュール固有のロガーを設定
+logger = logging.getLogger(__name__)
+
+def _run_git(repo_dir: str, args: List[str]) -> Optional[str]:
+    """ローカルのgitコマンドを実行して標準出力を取得"""
+    try:
+        result = subprocess.run(
+            ['git', '-C', repo_dir] + args,
+            capture_output=True, text=True, encoding='utf-8', check=True
+        )
+        return result.stdout
+    except FileNotFoundError:
+        logger.error("git command not found")
+        return None
+    except subprocess.CalledProcessError as e:
+        logger.error(f"git {' '.join(args)} failed: {e.stderr.strip()}")
+        return None
+
+def is_safe_ref(base_ref) -> bool:
+    """gitのオプションとして解釈されない参照名か判定"""
+    return isinstance(base_ref, str) and bool(base_ref.strip()) and not base_ref.startswith('-')
+
+def resolve_ref(project_dir: str, base_ref: str) -> Optional[str]:
+    """git参照をコミットのハッシュに解決（不正な参照の場合は None）"""
+    if not is_safe_ref(base_ref):
+        logger.error(f"Invalid git reference: {base_ref!r}")
+        return None
+    output = _run_git(project_dir, ['rev-parse', '--verify', '--quiet', '--end-of-options', f"{base_ref}^{{commit}}"])
+    if not output or not output.strip():
+        logger.error(f"Unknown git reference: {base_ref}")
+        return None
+    return output.strip()
+
+def get_changed_files(project_dir: str, base_ref: str, exclude_patterns: List[str]) -> Optional[List[str]]:
+    """base_ref 以降に変更されたPythonファイルの相対パスを取得
+
+    作業ツリーの未コミットの変更と未追跡ファイルも含める。
+    削除されたファイルは対象外。
+    """
+    commit = resolve_ref(project_dir, base_ref)
+    if commit is None:
+        return None
+    # -z で出力すると非ASCIIのパスもエスケープされずにそのまま得られる
+    diff_output = _run_git(project_dir, ['diff', '--name-only', '-z', '--relative', '--diff-filter=ACMR', commit, '--'])
+    if diff_output is None:
+        return None
+    untracked_output = _run_git(project_dir, ['ls-files', '-z', '--others', '--exclude-standard'])
+    if untracked_output is None:
+        return None
+
+    changed = {
+        utils.normalize_path(path)
+        for path in (diff_output + untracked_output).split('\0')
+        if path
+    }
+
+    # 除外パターンを適用した対象ファイルに絞り込む
+    python_files = [
+        utils.normalize_path(rel_path)
+        for rel_path, _ in utils.get_python_files(project_dir, exclude_patterns)
+    ]
+    delta = [rel_path for rel_path in python_files if rel_path in changed]
+    logger.info(f"Found {len(delta)} changed Python files since {base_ref}")
+    return delta
+
+def build_signature_context(project_dir: str, exclude_patterns: List[str], changed: List[str]) -> str:
+    """変更されていないモジュールのシグネチャ一覧を生成"""
+    changed_set = set(changed)
+    sections = []
+    for rel_path, filepath in utils.get_python_files(project_dir, exclude_patterns):
+        rel_path = utils.normalize_path(rel_path)
+        if rel_path in changed_set:
+            continue
+        content = utils.read_file_safely(filepath)
+        if content is None:
+            continue
+        signatures = extract_signatures(content, rel_path)
+        if signatures:
+            sections.append(f"## {rel_path}\n" + "\n".join(signatures))
+
+    if not sections:
+        return ""
+    return "# 変更されていないモジュールのシグネチャ\n\n" + "\n\n".join(sections) + "\n"
@@ -0,0 +1,169 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+# モジュール固有のロガーを設定
+logger = logging.getLogger(__name__)
+
+# タスクごとの既定のモデル区分（fast: 大量・小規模な処理、strong: 最終的な統合処理）
+TASK_TIERS = {
+    'generate': 'strong',
+    'repair': 'fast'
+}
+
+class ModelRouter:
+    """ステージとタスクに応じて使用するモデルを決定するクラス"""
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+
+    def _setting(self, key: str) -> str:
+        """設定値を文字列として取得（未設定は空文字）"""
+        return str(self.settings.get(key) or '').strip()
+
+    def model_for(self, stage: str, task: str = 'generate') -> str:
+        """使用するモデル名を取得
+
+        優先順位: ステージ別モデル（generate のみ） > タスク別モデル > 区分別モデル > openai_model
+        """
+        if task == 'generate' and self._setting(f"{stage}_model"):
+            return self._setting(f"{stage}_model")
+        if task != 'generate' and self._setting(f"{task}_model"):
+            return self._setting(f"{task}_model")
+        tier = TASK_TIERS.get(task, 'strong')
+        return self._setting(f"{tier}_model") or self._setting('openai_model') or 'gpt-4'
+
+class UsageTracker:
+    """モデルごとのリクエスト数・トークン数・所要時間を集計するクラス"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.models: Dict[str, Dict[str, float]] = {}
+
+    def record(self, model: str, latency: float, prompt_tokens: int = 0,
+               completion_tokens: int = 0, cached_tokens: int = 0, failed: bool = False) -> None:
+        """1リクエスト分の結果を記録"""
+        with self._lock:
+            stats = self.models.setdefault(model, {
+                'requests': 0, 'failures': 0, 'prompt_tokens': 0,
+                'cached_tokens': 0, 'completion_tokens': 0, 'latency': 0.0
+            })
+            stats['requests'] += 1
+            stats['failures'] += 1 if failed else 0
+            stats['prompt_tokens'] += prompt_tokens
+            stats['cached_tokens'] += cached_tokens
+            stats['completion_tokens'] += completion_tokens
+            stats['latency'] += latency
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """集計結果のコピーを取得"""
+        with self._lock:
+            return {model: dict(stats) for model, stats in self.models.items()}
+
+    def reset(self) -> None:
+        """集計をクリア"""
+        with self._lock:
+            self.models = {}
+
+    def report(self) -> str:
+        """モデルごとの集計結果を文字列で取得"""
+        with self._lock:
+            if not self.models:
+                return ""
+            lines = ["モデル別の使用状況:"]
+            for model, stats in sorted(self.models.items()):
+                average = stats['latency'] / stats['requests'] if stats['requests'] else 0.0
+                lines.append(
+                    f"- {model}: {stats['requests']} requests ({stats['failures']} failed), "
+                    f"prompt {stats['prompt_tokens']} (cached {stats['cached_tokens']}) / "
+                    f"completion {stats['completion_tokens']} tokens, "
+                    f"total {stats['latency']:.1f}s (avg {average:.1f}s)"
+                )
+            return "\n".join(lines)
+
+# プロセス全体で共有する集計
+usage_tracker = UsageTracker()
+
+# 応答をキャッシュしないタスク（再試行のたびに新しい応答が必要なため）
+UNCACHED_TASKS = ('repair',)
+
+class ResponseCache:
+    """同一のモデル・メッセージに対するAI応答を保持するLRUキャッシュ"""
+
+    def __init__(self, max_entries: int = 256):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], temperature: float) -> str:
+        """リクエスト内容からキャッシュキーを作成"""
+        payload = json.dumps([model, temperature, messages], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュされた応答を取得"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, content: str) -> None:
+        """応答を保存（上限を超えた場合は古いものから削除）"""
+        with self._lock:
+            self._entries[key] = content
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+def request_chat(client, model: str, messages: List[Dict[str, str]], temperature: float,
+                 stage: str, task: str = 'generate',
+                 cache: Optional[ResponseCache] = None,
+                 validate: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+    """Chat Completions APIを呼び出し、モデルごとの使用状況を記録
+
+    cache を指定した場合、同一リクエストにはキャッシュされた応答を返す。
+    応答は validate を通過した場合のみキャッシュし、UNCACHED_TASKS のタスクはキャッシュを使用しない。
+    """
+    if task in UNCACHED_TASKS:
+        cache = None
+    cache_key = ResponseCache.make_key(model, messages, temperature) if cache else None
+    if cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Using cached response for {stage}/{task} from {model}")
+            return cached
+
+    start = time.perf_counter()
+    try:
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature
+        )
+        usage = getattr(response, 'usage', None)
+        # プロンプトキャッシュが効いたトークン数（未対応のモデルでは 0）
+        details = getattr(usage, 'prompt_tokens_details', None)
+        usage_tracker.record(
+            model, time.perf_counter() - start,
+            getattr(usage, 'prompt_tokens', 0) or 0,
+            getattr(usage, 'completion_tokens', 0) or 0,
+            getattr(details, 'cached_tokens', 0) or 0
+        )
+        logger.info(f"Received response for {stage}/{task} from {model} in {time.perf_counter() - start:.1f}s")
+        content = response.choices[0].message.content
+        if cache and content and (validate is None or validate(content)):
+            cache.put(cache_key, content)
+        return content
+    except Exception:
+        usage_tracker.record(model, time.perf_counter() - start, failed=True)
+        raise
@@ -5,30 +5,61 @@ from merge_files import merge_py_files
 from generate_spec import generate_specification
 from generate_detailed_spec import generate_detailed_specification
 from check_refactoring import generate_refactoring_suggestions
+from pipeline import run_pipeline
+from dry_run import run_dry_run
+from llm_client import usage_tracker
+from server import run_server
+from git_delta import is_safe_ref
 from logging_config import setup_logging
 import logging
 import argparse
 
 logger = logging.getLogger(__name__)
 
+# --since を指定できる機能
+SINCE_CHOICES = ("2", "5")
+
+def git_ref(value: str) -> str:
+    """--since の値を検証（gitのオプションとして解釈される値は拒否）"""
+    if not is_safe_ref(value):
+        raise argparse.ArgumentTypeError(f"invalid git reference: {value!r}")
+    return value
+
 def main():
     try:
         # コマンドライン引数の解析
         parser = argparse.ArgumentParser(description='Python Files Processor')
         parser.add_argument('--debug', action='store_true', help='デバッグモードを有効化')
+        parser.add_argument('--since', metavar='REF', type=git_ref,
+                            help='指定したgit参照以降の変更ファイルのみを対象にする（機能2と5）')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='APIを呼び出さずにトークン数・コスト・所要時間を見積もる')
+        parser.add_argument('--serve', action='store_true',
+                            help='ジョブキューを持つローカルHTTPサーバーとして常駐する')
+        parser.add_argument('--port', type=int, help='--serve 時の待ち受けポート（既定は settings.ini）')
         args = parser.parse_args()
+        if args.since and (args.dry_run or args.serve):
+            parser.error("--since は --dry-run / --serve と同時に指定できません")
 
         # ロギング設定を初期化
         setup_logging(debug_mode=args.debug)
         logger.info("Application started")
         
+        if args.serve:
+            run_server(port=args.port)
+            return
+        
+        if args.dry_run:
+            report = run_dry_run()
+            print(report if report else "見積もりに失敗しました。")
+            return
+        
         functions = {
-            "1": lambda: (merge_py_files(), generate_specification(), 
-                         generate_detailed_specification(), generate_refactoring_suggestions()),
-            "2": merge_py_files,
+            "1": run_pipeline,
+            "2": lambda: merge_py_files(args.since),
             "3": generate_specification,
             "4": generate_detailed_specification,
-            "5": generate_refactoring_suggestions
+            "5": lambda: generate_refactoring_suggestions(args.since)
         }
         
         print("実行したい機能を選択してください:")
@@ -41,6 +72,10 @@ def main():
         choice = input("選択 (1, 2, 3, 4 または 5): ").strip()
         logger.debug(f"選択された機能: {choice}")
         
+        if args.since and choice in functions and choice not in SINCE_CHOICES:
+            print(f"--since は機能{'・'.join(SINCE_CHOICES)}でのみ指定できます。")
+            return
+        
         if choice in functions:
             try:
                 logger.info(f"機能{choice}の実行開始")
@@ -49,6 +84,11 @@ def main():
                 print("\n処理が正常に完了しました。")
                 if result:
                     print(f"処理結果: {result}")
+                # モデルごとのレイテンシ・トークン数を表示
+                usage_report = usage_tracker.report()
+                if usage_report:
+                    logger.debug(usage_report)
+                    print(usage_report)
             except Exception as e:
                 error_info = traceback.format_exc()
                 logger.error(f"Error during execution: {str(e)}\n{error_info}")
@@ -1,24 +1,45 @@
 #merge_files.py
-from typing import Optional, List
+from typing import Optional, List, Tuple
 import logging
 import os
 import fnmatch
 import configparser
 import utils
+from git_delta import get_changed_files
+from merge_store import open_merge_store
+from merge_shards import open_shard_writer
 
 # モジュールレベルのロガー設定
 logger = logging.getLogger(__name__)
 
+def package_order(rel_path: str) -> Tuple[str, str]:
+    """ファイルをディレクトリ（パッケージ）単位でまとめて並べるためのキー
+
+    単純なパス順ではサブパッケージが親パッケージのファイルの間に入るため、
+    ディレクトリ、ファイル名の順に比較する。
+    """
+    rel_path = utils.normalize_path(rel_path)
+    return os.path.dirname(rel_path), os.path.basename(rel_path)
+
 class PythonFileMerger:
-    def __init__(self, settings_path: str = 'settings.ini'):
-        """INI設定を読み込んでマージャーを初期化"""
+    def __init__(self, settings_path: str = 'settings.ini', settings: Optional[dict] = None,
+                 file_cache: Optional[utils.FileContentCache] = None):
+        """INI設定を読み込んでマージャーを初期化
+
+        Args:
+            settings (Optional[dict]): 指定した場合は設定ファイルを読まずにこの設定を使用
+            file_cache (Optional[utils.FileContentCache]): 常駐プロセスで再利用する読み込みキャッシュ
+        """
         try:
-            self.settings = utils.read_settings(settings_path)
+            self.settings = settings if settings is not None else utils.read_settings(settings_path)
+            self.file_cache = file_cache
             self.project_dir = os.path.abspath(self.settings['source_directory'])
             
             # 出力ディレクトリを設定（documentフォルダ）
             self.output_dir = os.path.join(self.project_dir, 'document')
             self.output_filename = self.settings['output_file']
+            # process_delta で対象とした変更ファイル（後続の処理で同じ一覧を再利用する）
+            self.changed_files: Optional[List[str]] = None
             
             # documentディレクトリが存在しない場合は作成
             if not os.path.exists(self.output_dir):
@@ -113,21 +134,34 @@ class PythonFileMerger:
 
     def _format_file_content(self, filename: str, content: str) -> str:
         """ファイル内容のフォーマット"""
-        separator = "=" * 80
-        return f"""
-{separator}
-File: {filename}
-{separator}
+        return utils.format_file_block(filename, content)
+
+    def _get_python_files(self) -> List[Tuple[str, str]]:
+        """マージ対象のPythonファイルを取得（キャッシュがあれば変更のないディレクトリを再走査しない）"""
+        if self.file_cache is not None:
+            return self.file_cache.python_files(self.project_dir, self.exclude_patterns)
+        return utils.get_python_files(self.project_dir, self.exclude_patterns)
 
-{content}
+    def _directory_structure(self) -> str:
+        """プロジェクトのディレクトリ構造を取得（キャッシュがあればファイル一覧が変わるまで再利用）"""
+        if self.file_cache is not None:
+            return self.file_cache.cached_for_listing(
+                self.project_dir, self.exclude_patterns, 'directory_structure',
+                lambda: self._get_directory_structure(self.project_dir)
+            )
+        return self._get_directory_structure(self.project_dir)
 
-"""
+    def _read_file(self, filepath: str) -> Optional[Tuple[str, str, str, int]]:
+        """ファイルを1回だけ読み込み、内容・文字コード・SHA-256・サイズを返す（キャッシュがあれば利用）"""
+        if self.file_cache is not None:
+            return self.file_cache.read_with_digest(filepath)
+        return utils.read_file_with_digest(filepath)
 
     def process(self) -> Optional[str]:
         """ファイルマージ処理を実行"""
         try:
             # Pythonファイルを収集（除外パターンを考慮）
-            python_files = utils.get_python_files(self.project_dir, self.exclude_patterns)
+            python_files = self._get_python_files()
             
             if not python_files:
                 logger.warning(f"No Python files found in {self.project_dir}")
@@ -135,46 +169,114 @@ File: {filename}
 
             logger.info(f"Found {len(python_files)} Python files to process")
             
-            # ディレクトリ構造を追加
-            merged_content = "# Merged Python Files\n\n"
-            merged_content += self._get_directory_structure(self.project_dir)
-            
-            # ファイル内容を追加
-            processed_count = 0
-            total_files = len(python_files)
-            
-            for rel_path, filepath in sorted(python_files):
-                content = utils.read_file_safely(filepath)
-                if content is not None:
-                    formatted_content = self._format_file_content(rel_path, content)
-                    merged_content += formatted_content
-                    processed_count += 1
-                else:
-                    logger.warning(f"Skipped file due to read error: {rel_path}")
-
             output_path = os.path.join(self.output_dir, self.output_filename)
             logger.info(f"Writing output to: {os.path.abspath(output_path)}")
             
-            # UTF-8でファイルを書き込み
+            # 構造化ストアも同じ走査で書き込む（設定で無効な場合は None）
+            store = open_merge_store(self.settings, self.output_dir)
+            # サイズ上限付きのシャードも同じ走査で書き込む（上限が未設定の場合は None）
+            shards = open_shard_writer(self.settings, self.output_dir)
+            processed_count = 0
             try:
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    f.write(merged_content)
-                logger.info(f"Successfully wrote merged content to {output_path}")
-                return output_path
+                with utils.atomic_open(output_path) as output:
+                    # ディレクトリ構造を追加
+                    output.write("# Merged Python Files\n\n")
+                    output.write(self._directory_structure())
+                    
+                    # ファイル内容を1件ずつ書き込む
+                    # 同じパッケージのファイルが連続するように並べる（シャードもこの順で分割する）
+                    for rel_path, filepath in sorted(python_files, key=lambda item: package_order(item[0])):
+                        result = self._read_file(filepath)
+                        if result is None:
+                            logger.warning(f"Skipped file due to read error: {rel_path}")
+                            continue
+                        content, encoding, sha256, size = result
+                        block = self._format_file_content(rel_path, content)
+                        output.write(block)
+                        if shards:
+                            shards.add_file(rel_path, block)
+                        if store:
+                            store.add_file(rel_path, content, encoding, sha256, size)
+                        processed_count += 1
             except Exception as e:
                 logger.error(f"Failed to write output file: {str(e)}")
+                if store:
+                    store.close(success=False)
+                if shards:
+                    shards.close(success=False)
                 return None
+            
+            if store:
+                store.close()
+            if shards:
+                shards.close()
+            logger.info(f"Successfully wrote {processed_count} files to {output_path}")
+            return output_path
 
         except Exception as e:
             logger.error(f"Error during file merge operation: {str(e)}")
             return None
 
-def merge_py_files() -> Optional[str]:
-    """マージ処理のエントリーポイント"""
+    @property
+    def delta_output_path(self) -> str:
+        """差分マージの出力パス（例: merge_delta.txt）"""
+        stem, ext = os.path.splitext(self.output_filename)
+        return os.path.join(self.output_dir, f"{stem}_delta{ext}")
+
+    def process_delta(self, base_ref: str) -> Optional[str]:
+        """base_ref 以降に変更されたファイルのみをマージ"""
+        try:
+            changed_files = get_changed_files(self.project_dir, base_ref, self.exclude_patterns)
+            if changed_files is None:
+                logger.error(f"Failed to get changed files since {base_ref}")
+                return None
+            self.changed_files = changed_files
+
+            # ディレクトリ構造と変更ファイルの一覧を追加
+            merged_content = f"# Merged Python Files (changed since {base_ref})\n\n"
+            merged_content += self._directory_structure()
+            merged_content += "\n# Changed Files\n\n"
+            merged_content += "".join(f"    {rel_path}\n" for rel_path in changed_files) or "    (no changes)\n"
+
+            for rel_path in changed_files:
+                result = self._read_file(os.path.join(self.project_dir, rel_path))
+                content = result[0] if result else None
+                if content is not None:
+                    merged_content += self._format_file_content(rel_path, content)
+                else:
+                    logger.warning(f"Skipped file due to read error: {rel_path}")
+
+            return self._write_output(self.delta_output_path, merged_content)
+
+        except Exception as e:
+            logger.error(f"Error during delta merge operation: {str(e)}")
+            return None
+
+    def _write_output(self, output_path: str, merged_content: str) -> Optional[str]:
+        """マージ結果をUTF-8で書き込む"""
+        logger.info(f"Writing output to: {os.path.abspath(output_path)}")
+        if utils.write_file_content(output_path, merged_content):
+            logger.info(f"Successfully wrote merged content to {output_path}")
+            return output_path
+        logger.error("Failed to write output file")
+        return None
+
+def merge_py_files(base_ref: Optional[str] = None, settings: Optional[dict] = None,
+                   file_cache: Optional[utils.FileContentCache] = None) -> Optional[str]:
+    """マージ処理のエントリーポイント
+
+    Args:
+        base_ref (Optional[str]): 指定した場合、このgit参照以降の変更ファイルのみをマージ
+        settings (Optional[dict]): 指定した場合は設定ファイルを読まずにこの設定を使用
+        file_cache (Optional[utils.FileContentCache]): ファイル読み込みのキャッシュ
+    """
     try:
         logger.info("Starting Python files merge process")
-        merger = PythonFileMerger()
-        merged_file_path = merger.process()
+        merger = PythonFileMerger(settings=settings, file_cache=file_cache)
+        if base_ref:
+            merged_file_path = merger.process_delta(base_ref)
+        else:
+            merged_file_path = merger.process()
         
         if merged_file_path:
             logger.info(f"File merge completed successfully. Output file: {os.path.abspath(merged_file_path)}")
@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+import utils
+
+# モジュール固有のロガーを設定
+logger = logging.getLogger(__name__)
+
+def shard_filename(output_filename: str, number: int) -> str:
+    """シャードのファイル名を取得（例: merge-0001.txt）"""
+    stem, ext = os.path.splitext(output_filename)
+    return f"{stem}-{number:04d}{ext}"
+
+def index_filename(output_filename: str) -> str:
+    """シャード索引のファイル名を取得（例: merge-index.json）"""
+    return f"{os.path.splitext(output_filename)[0]}-index.json"
+
+class ShardWriter:
+    """merge.txt と同じ走査で、サイズ上限付きのシャードを書き込むクラス
+
+    シャードはファイル境界でのみ分割し、同じディレクトリのファイルはできるだけ同じシャードにまとめる。
+    一時ファイルに書き込み、close(True) で完了した場合のみ置き換える。
+    """
+
+    def __init__(self, output_dir: str, output_filename: str, max_bytes: int = 0, max_tokens: int = 0):
+        self.output_dir = output_dir
+        self.output_filename = output_filename
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.shards: List[Dict] = []
+        self._temp_paths: List[Tuple[str, str]] = []
+        self._current = None
+        self._group_dir: Optional[str] = None
+        self._group: List[Tuple[str, str, int, int]] = []
+        self._group_bytes = 0
+        self._group_tokens = 0
+        # ディレクトリが上限を超えて分割が確定した後はバッファせずに書き込む
+        self._streaming = False
+
+    def _exceeds(self, shard: Dict, size: int, tokens: int) -> bool:
+        """追加すると上限を超えるか判定"""
+        if self.max_bytes and shard['bytes'] + size > self.max_bytes:
+            return True
+        if self.max_tokens and shard['tokens'] + tokens > self.max_tokens:
+            return True
+        return False
+
+    def _open_shard(self) -> None:
+        """新しいシャードを開始"""
+        if self._current:
+            self._current['handle'].close()
+        number = len(self.shards) + 1
+        filename = shard_filename(self.output_filename, number)
+        path = os.path.join(self.output_dir, filename)
+        temp_path = utils.make_temp_path(path)
+        self._temp_paths.append((temp_path, path))
+        handle = open(temp_path, 'w', encoding='utf-8')
+        header = f"# Merged Python Files (shard {number:04d})\n"
+        handle.write(header)
+        self._current = {
+            'file': filename, 'bytes': len(header.encode('utf-8')),
+            'tokens': utils.estimate_tokens(header),
+            'files': [], 'directories': [], 'handle': handle
+        }
+        self.shards.append(self._current)
+
+    def _write(self, rel_path: str, block: str, size: int, tokens: int) -> None:
+        """現在のシャードにファイルを書き込む"""
+        shard = self._current
+        shard['handle'].write(block)
+        shard['bytes'] += size
+        shard['tokens'] += tokens
+        shard['files'].append(rel_path)
+        directory = os.path.dirname(rel_path)
+        if directory not in shard['directories']:
+            shard['directories'].append(directory)
+
+    def _place(self, rel_path: str, block: str, size: int, tokens: int) -> None:
+        """ファイル境界で分割しながら現在のシャードに書き込む"""
+        if self._current['files'] and self._exceeds(self._current, size, tokens):
+            self._open_shard()
+        self._write(rel_path, block, size, tokens)
+
+    def _flush_group(self) -> None:
+        """バッファしたディレクトリ単位のファイル群をシャードに振り分ける"""
+        if not self._group:
+            return
+        # ディレクトリ全体が現在のシャードに入らなければ新しいシャードから始める
+        if self._current is None or (
+                self._current['files'] and self._exceeds(self._current, self._group_bytes, self._group_tokens)):
+            self._open_shard()
+        for item in self._group:
+            # ディレクトリ単体で上限を超える場合のみファイル境界で分割
+            self._place(*item)
+        self._group = []
+        self._group_bytes = 0
+        self._group_tokens = 0
+
+    def add_file(self, rel_path: str, block: str) -> None:
+        """merge.txt 形式のファイルブロックを追加"""
+        rel_path = utils.normalize_path(rel_path)
+        directory = os.path.dirname(rel_path)
+        if directory != self._group_dir:
+            self._flush_group()
+            self._group_dir = directory
+            self._streaming = False
+
+        item = (rel_path, block, len(block.encode('utf-8')), utils.estimate_tokens(block))
+        if self._streaming:
+            self._place(*item)
+            return
+
+        self._group.append(item)
+        self._group_bytes += item[2]
+        self._group_tokens += item[3]
+        # 空のシャードにも収まらない大きさになった時点で分割は避けられないため、
+        # バッファを書き出して残りのファイルは直接書き込む（メモリ使用量を上限程度に抑える）
+        if self._exceeds({'bytes': 0, 'tokens': 0}, self._group_bytes, self._group_tokens):
+            self._flush_group()
+            self._streaming = True
+
+    def _remove_stale_shards(self) -> None:
+        """前回の実行で作成された余分なシャードを削除"""
+        stem, ext = os.path.splitext(self.output_filename)
+        pattern = re.compile(rf"^{re.escape(stem)}-\d{{4}}{re.escape(ext)}$")
+        current = {shard['file'] for shard in self.shards}
+        for filename in os.listdir(self.output_dir):
+            if pattern.match(filename) and filename not in current:
+                os.remove(os.path.join(self.output_dir, filename))
+
+    def close(self, success: bool = True) -> Optional[str]:
+        """書き込みを終了して索引を出力（success が False の場合は破棄）
+
+        Returns:
+            索引ファイルのパス
+        """
+        try:
+            if success:
+                self._flush_group()
+        finally:
+            if self._current:
+                self._current['handle'].close()
+
+        if not success:
+            for temp_path, _ in self._temp_paths:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            return None
+
+        for temp_path, path in self._temp_paths:
+            utils.commit_temp_path(temp_path, path)
+        self._remove_stale_shards()
+
+        index = {
+            'max_bytes': self.max_bytes,
+            'max_tokens': self.max_tokens,
+            'total_files': sum(len(shard['files']) for shard in self.shards),
+            'shards': [
+                {key: value for key, value in shard.items() if key != 'handle'}
+                for shard in self.shards
+            ]
+        }
+        index_path = os.path.join(self.output_dir, index_filename(self.output_filename))
+        if not utils.write_file_content(index_path, json.dumps(index, ensure_ascii=False, indent=2)):
+            return None
+        logger.info(f"Wrote {len(self.shards)} shards for {index['total_files']} files, index: {index_path}")
+        return index_path
+
+def open_shard_writer(settings: dict, output_dir: str) -> Optional[ShardWriter]:
+    """設定に応じてシャードの書き込みを開始（上限が未設定の場合は None）"""
+    max_bytes = max(utils.get_int_setting(settings, 'shard_max_bytes', 0), 0)
+    max_tokens = max(utils.get_int_setting(settings, 'shard_max_tokens', 0), 0)
+    if not max_bytes and not max_tokens:
+        return None
+    return ShardWriter(output_dir, settings['output_file'], max_bytes, max_tokens)
+
+def load_shard_index(output_dir: str, output_filename: str) -> Optional[Dict]:
+    """シャード索引を読み込む"""
+    content = utils.read_file_safely(os.path.join(output_dir, index_filename(output_filename)))
+    if content is None:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError as e:
+        logger.error(f"Invalid shard index: {e}")
+        return None
@@ -0,0 +1,221 @@
+import os
+import gzip
+import lzma
+import json
+import base64
+import fnmatch
+import sqlite3
+import hashlib
+import logging
+from typing import Dict, Iterator, List, Optional
+import utils
+from code_analysis import extract_symbols
+
+# モジュール固有のロガーを設定
+logger = logging.getLogger(__name__)
+
+STORE_FORMATS = ('sqlite', 'jsonl')
+COMPRESSORS = {
+    'none': (lambda data: data, lambda data: data),
+    'gzip': (gzip.compress, gzip.decompress),
+    'lzma': (lzma.compress, lzma.decompress)
+}
+
+def store_path(output_dir: str, output_filename: str, store_format: str) -> str:
+    """構造化ストアのパスを取得（例: merge.sqlite / merge.jsonl）"""
+    stem = os.path.splitext(output_filename)[0]
+    return os.path.join(output_dir, f"{stem}.{store_format}")
+
+def _make_record(rel_path: str, content: str, encoding: str, compression: str,
+                 sha256: Optional[str] = None, size: Optional[int] = None) -> Dict:
+    """1ファイル分のレコードを作成
+
+    sha256 と size は元ファイルのバイト列から求めた値を受け取り（未指定の場合は保存する内容から計算）、
+    内容はUTF-8で保存する。
+    """
+    data = content.encode('utf-8')
+    return {
+        'path': rel_path,
+        'directory': os.path.dirname(rel_path),
+        'encoding': encoding,
+        'sha256': sha256 if sha256 is not None else hashlib.sha256(data).hexdigest(),
+        'size': size if size is not None else len(data),
+        'compression': compression,
+        'content': COMPRESSORS[compression][0](data),
+        'symbols': extract_symbols(content, rel_path)
+    }
+
+def _decode_content(data: bytes, compression: str) -> str:
+    """保存された内容を展開して文字列に戻す"""
+    return COMPRESSORS[compression][1](data).decode('utf-8')
+
+class MergeStoreWriter:
+    """merge.txt と同じ走査で構造化ストアを書き込むクラス
+
+    一時ファイルに書き込み、close(True) で完了した場合のみ置き換える。
+    """
+
+    def __init__(self, path: str, store_format: str, compression: str = 'none'):
+        if store_format not in STORE_FORMATS:
+            raise ValueError(f"Unsupported structured store format: {store_format}")
+        if compression not in COMPRESSORS:
+            raise ValueError(f"Unsupported store compression: {compression}")
+        self.path = path
+        self.store_format = store_format
+        self.compression = compression
+        self.count = 0
+        self._temp_path = utils.make_temp_path(path)
+        if store_format == 'sqlite':
+            self._conn = sqlite3.connect(self._temp_path)
+            self._conn.executescript("""
+                CREATE TABLE files (
+                    path TEXT PRIMARY KEY,
+                    directory TEXT NOT NULL,
+                    encoding TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    compression TEXT NOT NULL,
+                    content BLOB NOT NULL,
+                    symbols TEXT NOT NULL
+                );
+                CREATE INDEX idx_files_directory ON files (directory);
+            """)
+        else:
+            self._file = open(self._temp_path, 'w', encoding='utf-8')
+
+    def add_file(self, rel_path: str, content: str, encoding: str,
+                 sha256: Optional[str] = None, size: Optional[int] = None) -> None:
+        """1ファイル分のレコードを追加
+
+        sha256 と size には読み込み時に元ファイルのバイト列から求めた値を渡す（utils.read_file_with_digest）。
+        """
+        record = _make_record(utils.normalize_path(rel_path), content, encoding, self.compression, sha256, size)
+        if self.store_format == 'sqlite':
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (record['path'], record['directory'], record['encoding'], record['sha256'],
+                 record['size'], record['compression'], record['content'],
+                 json.dumps(record['symbols'], ensure_ascii=False))
+            )
+        else:
+            # 圧縮時はbase64、非圧縮時はそのままのテキストで保存
+            if self.compression == 'none':
+                record['content'] = record['content'].decode('utf-8')
+            else:
+                record['content'] = base64.b64encode(record['content']).decode('ascii')
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def close(self, success: bool = True) -> Optional[str]:
+        """書き込みを終了（success が False の場合は破棄）"""
+        if self.store_format == 'sqlite':
+            if success:
+                self._conn.commit()
+            self._conn.close()
+        else:
+            self._file.close()
+
+        if success:
+            utils.commit_temp_path(self._temp_path, self.path)
+            logger.info(f"Wrote {self.count} records to structured store {self.path}")
+            return self.path
+        os.remove(self._temp_path)
+        return None
+
+class MergeStoreReader:
+    """構造化ストアからファイル単位で読み出すクラス"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.store_format = os.path.splitext(path)[1].lstrip('.')
+        if self.store_format not in STORE_FORMATS:
+            raise ValueError(f"Unsupported structured store: {path}")
+
+    def _iter_records(self, with_content: bool) -> Iterator[Dict]:
+        """レコードをパス順に1件ずつ取得"""
+        if self.store_format == 'sqlite':
+            columns = "path, directory, encoding, sha256, size, compression, symbols"
+            if with_content:
+                columns += ", content"
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            try:
+                conn.row_factory = sqlite3.Row
+                for row in conn.execute(f"SELECT {columns} FROM files ORDER BY path"):
+                    record = dict(row)
+                    record['symbols'] = json.loads(record['symbols'])
+                    if with_content:
+                        record['content'] = _decode_content(record['content'], record['compression'])
+                    yield record
+            finally:
+                conn.close()
+        else:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    if not with_content:
+                        record.pop('content')
+                    elif record['compression'] != 'none':
+                        record['content'] = _decode_content(
+                            base64.b64decode(record['content']), record['compression']
+                        )
+                    yield record
+
+    def iter_files(self, pattern: Optional[str] = None, offset: int = 0,
+                   limit: Optional[int] = None, with_content: bool = True) -> Iterator[Dict]:
+        """条件に合うファイルをページ単位で取得
+
+        Args:
+            pattern (Optional[str]): パスに対するワイルドカード（例: "pkg/*.py"）
+            offset (int): 読み飛ばす件数
+            limit (Optional[int]): 取得する最大件数
+            with_content (bool): Falseの場合は内容を展開せずメタデータのみを返す
+        """
+        matched = 0
+        returned = 0
+        for record in self._iter_records(with_content):
+            if pattern and not fnmatch.fnmatch(record['path'], pattern):
+                continue
+            matched += 1
+            if matched <= offset:
+                continue
+            if limit is not None and returned >= limit:
+                break
+            returned += 1
+            yield record
+
+    def list_files(self) -> List[str]:
+        """格納されているファイルのパス一覧を取得"""
+        return [record['path'] for record in self._iter_records(with_content=False)]
+
+    def get_file(self, rel_path: str) -> Optional[Dict]:
+        """指定したパスのレコードを取得"""
+        rel_path = utils.normalize_path(rel_path)
+        if self.store_format == 'sqlite':
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            try:
+                conn.row_factory = sqlite3.Row
+                row = conn.execute("SELECT * FROM files WHERE path = ?", (rel_path,)).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                return None
+            record = dict(row)
+            record['symbols'] = json.loads(record['symbols'])
+            record['content'] = _decode_content(record['content'], record['compression'])
+            return record
+        return next((r for r in self.iter_files() if r['path'] == rel_path), None)
+
+def open_merge_store(settings: dict, output_dir: str) -> Optional[MergeStoreWriter]:
+    """設定に応じて構造化ストアの書き込みを開始（無効な場合は None）"""
+    store_format = settings.get('structured_store', 'none')
+    if not store_format or store_format == 'none':
+        return None
+    # 構造化ストアは任意の出力のため、設定の誤りでマージ全体を中断しない
+    try:
+        return MergeStoreWriter(
+            store_path(output_dir, settings['output_file'], store_format),
+            store_format, settings.get('store_compression', 'none') or 'none'
+        )
+    except ValueError as e:
+        logger.warning(f"Structured store disabled: {e}")
+        return None
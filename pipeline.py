@@ -0,0 +1,192 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+import utils
+from utils import hash_file
+from merge_files import merge_py_files
+from generate_spec import generate_specification
+from generate_detailed_spec import generate_detailed_specification
+from check_refactoring import generate_refactoring_suggestions
+
+# モジュール固有のロガーを設定
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = 'pipeline_manifest.json'
+
+# 各ステージの入力に含める設定キー
+MODEL_SETTING_KEYS = ['openai_model', 'fast_model', 'strong_model', 'repair_model']
+STAGE_SETTING_KEYS = {
+    'merge': ['source_directory', 'output_file', 'exclusions', 'structured_store', 'store_compression',
+              'shard_max_bytes', 'shard_max_tokens'],
+    'spec': MODEL_SETTING_KEYS + ['spec_model', 'spec_token_budget'],
+    'detailed': MODEL_SETTING_KEYS + ['detailed_model', 'detailed_token_budget', 'max_repair_attempts'],
+    'refactoring': MODEL_SETTING_KEYS + ['refactoring_model', 'refactoring_token_budget',
+                                         'max_repair_attempts', 'retrieval_top_k']
+}
+
+def hash_sources(project_dir: str, exclude_patterns: List[str],
+                 file_cache: Optional[utils.FileContentCache] = None) -> str:
+    """マージ対象のPythonファイル全体のハッシュを取得
+
+    file_cache を指定した場合、変更のないファイルは読み込まずにキャッシュしたハッシュを使用する。
+    """
+    if file_cache is not None:
+        python_files, file_hash = file_cache.python_files(project_dir, exclude_patterns), file_cache.file_hash
+    else:
+        python_files, file_hash = utils.get_python_files(project_dir, exclude_patterns), hash_file
+    digest = hashlib.sha256()
+    for rel_path, filepath in python_files:
+        digest.update(utils.normalize_path(rel_path).encode('utf-8'))
+        digest.update((file_hash(filepath) or '').encode('ascii'))
+    return digest.hexdigest()
+
+def hash_settings(settings: dict, keys: List[str]) -> str:
+    """ステージに関係する設定値のハッシュを取得"""
+    values = {key: settings.get(key) for key in keys}
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+class CheckpointManifest:
+    """パイプラインの各ステージの実行結果を記録するマニフェスト"""
+
+    def __init__(self, document_dir: str):
+        self.path = os.path.join(document_dir, MANIFEST_FILENAME)
+        self.stages: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        """マニフェストを読み込む（壊れている場合は空として扱う）"""
+        if not os.path.exists(self.path):
+            return {}
+        content = utils.read_file_safely(self.path)
+        try:
+            return json.loads(content or '{}').get('stages', {})
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring invalid checkpoint manifest {self.path}: {e}")
+            return {}
+
+    def save(self) -> bool:
+        """マニフェストを書き込む"""
+        content = json.dumps({'stages': self.stages}, ensure_ascii=False, indent=2)
+        return utils.write_file_content(self.path, content)
+
+    def is_fresh(self, stage: str, input_hashes: Dict[str, Optional[str]]) -> bool:
+        """入力が変わっておらず、出力が検証済みのまま残っているか判定"""
+        entry = self.stages.get(stage)
+        if not entry or entry.get('status') != 'completed':
+            return False
+        if entry.get('input_hashes') != input_hashes:
+            return False
+        output_path = entry.get('output_path')
+        # 相対パスは記録したプロセスのカレントディレクトリに依存するため再実行する
+        if not output_path or not os.path.isabs(output_path):
+            return False
+        return hash_file(output_path) == entry.get('output_hash')
+
+    def record(self, stage: str, input_hashes: Dict[str, Optional[str]],
+               output_path: Optional[str], status: str) -> None:
+        """ステージの実行結果を記録して保存（出力パスは絶対パスで記録）"""
+        if output_path:
+            output_path = os.path.abspath(output_path)
+        self.stages[stage] = {
+            'status': status,
+            'input_hashes': input_hashes,
+            'output_path': output_path,
+            'output_hash': hash_file(output_path) if output_path else None,
+            'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        self.save()
+
+class PipelineRunner:
+    """チェックポイントを利用して全ステージを順に実行するクラス"""
+
+    def __init__(self, settings_path: str = 'settings.ini', settings: Optional[dict] = None,
+                 client=None, response_cache=None,
+                 file_cache: Optional[utils.FileContentCache] = None):
+        """設定を読み込んで初期化
+
+        client / response_cache / file_cache は常駐プロセスで再利用するためのもの。
+        """
+        self.settings = settings if settings is not None else utils.read_settings(settings_path)
+        self.llm_options = {'settings': self.settings, 'client': client, 'response_cache': response_cache}
+        self.file_cache = file_cache
+        self.project_dir = os.path.abspath(self.settings['source_directory'])
+        self.document_dir = os.path.join(self.project_dir, 'document')
+        os.makedirs(self.document_dir, exist_ok=True)
+        self.exclude_patterns = [
+            pattern.strip() for pattern in self.settings['exclusions'].split(',')
+            if pattern.strip()
+        ]
+        self.manifest = CheckpointManifest(self.document_dir)
+
+    def _document_path(self, filename: str) -> str:
+        """documentフォルダ内のパスを取得"""
+        return os.path.join(self.document_dir, filename)
+
+    def _hash_file(self, path: str) -> Optional[str]:
+        """ファイルのハッシュを取得（キャッシュがあれば利用）"""
+        if self.file_cache is not None:
+            return self.file_cache.file_hash(path)
+        return hash_file(path)
+
+    def _stage_inputs(self, stage: str) -> Dict[str, Optional[str]]:
+        """ステージの入力ハッシュを取得"""
+        inputs = {'settings': hash_settings(self.settings, STAGE_SETTING_KEYS[stage])}
+        if stage == 'merge':
+            inputs['sources'] = hash_sources(self.project_dir, self.exclude_patterns, self.file_cache)
+        else:
+            inputs['merge'] = self._hash_file(self._document_path(self.settings['output_file']))
+        if stage == 'detailed':
+            inputs['spec'] = self._hash_file(self._document_path('requirements_spec.txt'))
+        return inputs
+
+    def is_stage_fresh(self, stage: str) -> bool:
+        """ステージを再実行せずに済むか判定"""
+        input_hashes = self._stage_inputs(stage)
+        return None not in input_hashes.values() and self.manifest.is_fresh(stage, input_hashes)
+
+    def run_merge_stage(self) -> Optional[str]:
+        """マージステージのみを実行（入力が変わっていなければスキップ）"""
+        return self._run_stage('merge', lambda: merge_py_files(settings=self.settings, file_cache=self.file_cache))
+
+    def _run_stage(self, stage: str, func: Callable[[], Optional[str]]) -> Optional[str]:
+        """入力が変わっていなければスキップし、そうでなければ実行して記録"""
+        input_hashes = self._stage_inputs(stage)
+        if None in input_hashes.values():
+            logger.error(f"Stage {stage} skipped: required input is missing")
+            self.manifest.record(stage, input_hashes, None, 'failed')
+            return None
+
+        if self.manifest.is_fresh(stage, input_hashes):
+            output_path = self.manifest.stages[stage]['output_path']
+            logger.info(f"Stage {stage} is up to date, skipping: {output_path}")
+            return output_path
+
+        logger.info(f"Running stage {stage}")
+        self.manifest.record(stage, input_hashes, None, 'running')
+        output_path = func() or None
+        if output_path:
+            output_path = os.path.abspath(output_path)
+        self.manifest.record(stage, input_hashes, output_path, 'completed' if output_path else 'failed')
+        if not output_path:
+            logger.error(f"Stage {stage} failed")
+        return output_path
+
+    def run(self) -> tuple:
+        """全ステージを実行（各ステージの出力パスを返す）"""
+        # 依存するステージが失敗した場合は後続を実行しない
+        merge_path = self.run_merge_stage()
+        if not merge_path:
+            return merge_path, None, None, None
+        spec_path = self._run_stage('spec', lambda: generate_specification(**self.llm_options))
+        detailed_path = (
+            self._run_stage('detailed', lambda: generate_detailed_specification(**self.llm_options))
+            if spec_path else None
+        )
+        refactoring_path = self._run_stage('refactoring', lambda: generate_refactoring_suggestions(**self.llm_options))
+        return merge_path, spec_path, detailed_path, refactoring_path
+
+def run_pipeline() -> tuple:
+    """全てを順に実行するエントリーポイント"""
+    return PipelineRunner().run()
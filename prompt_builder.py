@@ -0,0 +1,29 @@
+from typing import Dict, List
+
+# 全ステージで共通のシステムプロンプト（プロンプトキャッシュの対象となる先頭部分）
+COMMON_SYSTEM_PROMPT = (
+    "あなたはPythonコードを解析し、仕様書やリファクタリング提案を日本語で作成する"
+    "経験豊富なソフトウェアエンジニアです。"
+)
+
+CODE_BLOCK_HEADER = "以下は解析対象のPythonコードです。\n\nコード：\n"
+CODE_BLOCK_FOOTER = "\n\n" + "-" * 80 + "\n\n"
+
+def build_code_prefix(code_content: str) -> str:
+    """全ステージで共通のコードブロックを生成
+
+    同じコードに対しては常にバイト単位で同一の文字列となるため、
+    プロバイダ側のプロンプトキャッシュを再利用できる。
+    """
+    return f"{CODE_BLOCK_HEADER}{code_content}{CODE_BLOCK_FOOTER}"
+
+def build_user_prompt(code_content: str, instructions: str) -> str:
+    """コードブロックの後ろにステージ固有の指示を続けたプロンプトを生成"""
+    return build_code_prefix(code_content) + instructions
+
+def build_messages(prompt: str) -> List[Dict[str, str]]:
+    """共通のシステムプロンプトを付けてAPIに送信するメッセージを生成"""
+    return [
+        {"role": "system", "content": COMMON_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
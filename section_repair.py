@@ -0,0 +1,168 @@
+import re
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from utils import estimate_tokens
+from prompt_builder import build_user_prompt
+
+# モジュール固有のロガーを設定
+logger = logging.getLogger(__name__)
+
+# 本文が未記入とみなすプレースホルダ（例: [具体的な提案内容]）
+PLACEHOLDER_PATTERN = re.compile(r'^\[[^\]]*\]$')
+
+def _find_heading(content: str, heading: str, start: int = 0) -> int:
+    """行頭にある見出しの位置を取得（見つからない場合は -1）"""
+    match = re.search(rf'^[ \t]*{re.escape(heading)}.*$', content[start:], re.MULTILINE)
+    return start + match.start() if match else -1
+
+def _section_span(content: str, sections: List[str], heading: str) -> Optional[Tuple[int, int, int]]:
+    """見出しの開始位置、本文の開始位置、本文の終了位置を取得"""
+    start = _find_heading(content, heading)
+    if start < 0:
+        return None
+    body_start = content.find('\n', start)
+    body_start = len(content) if body_start < 0 else body_start + 1
+
+    # 次に現れる必須見出しまでを本文とみなす
+    body_end = len(content)
+    for other in sections:
+        if other == heading:
+            continue
+        pos = _find_heading(content, other, body_start)
+        if 0 <= pos < body_end:
+            body_end = pos
+    return start, body_start, body_end
+
+def _is_empty_body(body: str) -> bool:
+    """本文が空またはプレースホルダのみか判定"""
+    lines = [line.strip() for line in body.splitlines() if line.strip()]
+    return all(PLACEHOLDER_PATTERN.match(line) for line in lines)
+
+def find_incomplete_sections(content: str, required_sections: List[str]) -> List[str]:
+    """欠落または本文が空の必須セクションを取得
+
+    先頭の見出しは文書タイトルとして扱い、存在のみを確認する。
+    """
+    incomplete = []
+    for index, heading in enumerate(required_sections):
+        span = _section_span(content, required_sections, heading)
+        if span is None:
+            incomplete.append(heading)
+        elif index > 0 and _is_empty_body(content[span[1]:span[2]]):
+            incomplete.append(heading)
+    return incomplete
+
+def splice_section(content: str, required_sections: List[str], heading: str, body: str) -> str:
+    """セクションを本来の位置に差し込む（既存の空セクションは置き換える）"""
+    body = body.strip('\n')
+    block = f"{heading}\n{body}\n\n" if body else f"{heading}\n\n"
+
+    span = _section_span(content, required_sections, heading)
+    if span is not None:
+        return content[:span[0]] + block + content[span[2]:]
+
+    # 後続の必須見出しのうち最初に存在するものの直前に挿入
+    index = required_sections.index(heading)
+    for following in required_sections[index + 1:]:
+        pos = _find_heading(content, following)
+        if pos >= 0:
+            return content[:pos] + block + content[pos:]
+    if content and not content.endswith('\n'):
+        content += '\n'
+    return content + ('\n' if content else '') + block.rstrip('\n') + '\n'
+
+def extract_sections(reply: str, headings: List[str]) -> Dict[str, str]:
+    """AI応答から指定の見出しごとの本文を抽出"""
+    sections = {}
+    for heading in headings:
+        span = _section_span(reply, headings, heading)
+        if span is None:
+            continue
+        body = reply[span[1]:span[2]].strip()
+        if not _is_empty_body(body):
+            sections[heading] = body
+    return sections
+
+def build_repair_prompt(document: str, sections: List[str], code_content: str,
+                        extra_context: str = "") -> str:
+    """欠落セクションのみを生成させるプロンプトを作成
+
+    元の生成と同じコードブロックを先頭に置き、プロンプトキャッシュを再利用できるようにする。
+    """
+    heading_list = "\n".join(sections)
+    instructions = f"""以下の文書では次のセクションが欠落しているか、内容が空です。
+上記のコードを基に、これらのセクションのみを、見出しをそのまま付けて日本語で出力してください。
+他のセクションや前置きは出力しないでください。
+
+対象セクション：
+{heading_list}
+
+現在の文書：
+{document}"""
+    if extra_context:
+        instructions += f"\n\n{extra_context}"
+    return build_user_prompt(code_content, instructions)
+
+class SectionRepairer:
+    """欠落したセクションのみを再生成して文書に差し込むクラス"""
+
+    def __init__(self, required_sections: List[str], request_fn: Callable[[str], Optional[str]],
+                 max_attempts: int = 2):
+        self.required_sections = required_sections
+        self.request_fn = request_fn
+        self.max_attempts = max_attempts
+
+    def repair(self, content: str, code_content: str, extra_context: str = "") -> Tuple[str, Dict[str, int]]:
+        """欠落セクションを修復
+
+        Returns:
+            (修復後の文書, 修復の統計情報)
+        """
+        metrics = {
+            'repaired_sections': 0,
+            'repair_requests': 0,
+            'repair_output_tokens': 0,
+            'full_output_tokens': 0,
+            'saved_output_tokens': 0
+        }
+
+        incomplete = find_incomplete_sections(content, self.required_sections)
+        if not incomplete:
+            return content, metrics
+
+        # タイトルはAIに問い合わせず見出しのみ補う
+        title = self.required_sections[0]
+        if title in incomplete:
+            content = splice_section(content, self.required_sections, title, "")
+            incomplete.remove(title)
+            metrics['repaired_sections'] += 1
+
+        for attempt in range(1, self.max_attempts + 1):
+            if not incomplete:
+                break
+            logger.info(f"Repairing sections (attempt {attempt}/{self.max_attempts}): {incomplete}")
+            reply = self.request_fn(build_repair_prompt(content, incomplete, code_content, extra_context))
+            metrics['repair_requests'] += 1
+            if not reply:
+                continue
+
+            for heading, body in extract_sections(reply, incomplete).items():
+                content = splice_section(content, self.required_sections, heading, body)
+                metrics['repaired_sections'] += 1
+                metrics['repair_output_tokens'] += estimate_tokens(body)
+            incomplete = find_incomplete_sections(content, self.required_sections)
+
+        # 全体を再生成した場合の出力量と比較して削減量を記録
+        metrics['full_output_tokens'] = estimate_tokens(content)
+        metrics['saved_output_tokens'] = max(
+            metrics['full_output_tokens'] - metrics['repair_output_tokens'], 0
+        )
+        if incomplete:
+            logger.warning(f"Sections still incomplete after {self.max_attempts} attempts: {incomplete}")
+        logger.info(
+            f"Section repair: {metrics['repaired_sections']} sections repaired in "
+            f"{metrics['repair_requests']} requests, ~{metrics['repair_output_tokens']} tokens generated "
+            f"instead of ~{metrics['full_output_tokens']} for a full rerun "
+            f"(saved ~{metrics['saved_output_tokens']} tokens)"
+        )
+        return content, metrics
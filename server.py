@@ -0,0 +1,368 @@
+import os
+import json
+import time
+import queue
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from openai import OpenAI
+import utils
+from merge_files import merge_py_files
+from generate_spec import generate_specification
+from generate_detailed_spec import generate_detailed_specification
+from check_refactoring import generate_refactoring_suggestions
+from pipeline import PipelineRunner
+from dry_run import DryRunPlanner
+from llm_client import ResponseCache, usage_tracker
+from git_delta import is_safe_ref
+
+# モジュール固有のロガーを設定
+logger = logging.getLogger(__name__)
+
+JOB_TYPES = ('merge', 'spec', 'detailed', 'refactoring', 'pipeline', 'dry_run')
+
+# 保持する完了済みジョブの上限
+MAX_FINISHED_JOBS = 1000
+
+class ProjectContext:
+    """プロジェクトごとに保持するウォームキャッシュ（設定・クライアント・読み込み結果・マニフェスト）"""
+
+    def __init__(self, project_root: str, settings_path: str, file_cache_bytes: int = 0):
+        self.project_root = project_root
+        self.settings_path = settings_path
+        self.settings_mtime = os.path.getmtime(settings_path) if os.path.exists(settings_path) else None
+        self.settings = utils.read_settings(settings_path)
+        self.settings['source_directory'] = project_root
+        self.file_cache = utils.FileContentCache(max_bytes=file_cache_bytes)
+        self._client: Optional[OpenAI] = None
+        self._runner: Optional[PipelineRunner] = None
+
+    def is_stale(self) -> bool:
+        """設定ファイルが更新されたか判定"""
+        mtime = os.path.getmtime(self.settings_path) if os.path.exists(self.settings_path) else None
+        return mtime != self.settings_mtime
+
+    def client(self) -> OpenAI:
+        """OpenAIクライアントを取得（初回のみ作成）"""
+        if self._client is None:
+            self._client = OpenAI(api_key=self.settings['openai_api_key'])
+        return self._client
+
+    def runner(self, response_cache: ResponseCache) -> PipelineRunner:
+        """チェックポイントマニフェストを保持したパイプラインを取得"""
+        if self._runner is None:
+            self._runner = PipelineRunner(
+                settings=self.settings, client=self.client(),
+                response_cache=response_cache, file_cache=self.file_cache
+            )
+        return self._runner
+
+class Job:
+    """キューに投入された1件の処理"""
+
+    def __init__(self, job_type: str, project_root: str, base_ref: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.project_root = project_root
+        self.base_ref = base_ref
+        self.status = 'queued'
+        self.result = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        """ステータス照会用の辞書に変換"""
+        def _format(timestamp: Optional[float]) -> Optional[str]:
+            return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else None
+
+        queue_end = self.started_at or time.time()
+        run_end = self.finished_at or time.time()
+        return {
+            'id': self.id,
+            'type': self.type,
+            'project_root': self.project_root,
+            'base_ref': self.base_ref,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'submitted_at': _format(self.submitted_at),
+            'started_at': _format(self.started_at),
+            'finished_at': _format(self.finished_at),
+            'queue_seconds': round(queue_end - self.submitted_at, 3),
+            'run_seconds': round(run_end - self.started_at, 3) if self.started_at else None
+        }
+
+class JobService:
+    """ジョブキューと固定数のワーカースレッドでジョブを処理するクラス"""
+
+    def __init__(self, settings_path: str = 'settings.ini', workers: int = 2, queue_size: int = 100,
+                 allowed_roots: Optional[List[str]] = None, max_projects: int = 8,
+                 file_cache_bytes: int = 64 * 1024 * 1024):
+        self.settings_path = os.path.abspath(settings_path)
+        self.allowed_roots = [os.path.realpath(root) for root in allowed_roots or []]
+        # ウォームキャッシュはプロジェクト数・読み込み量の上限を超えたら古いものから破棄する
+        self.max_projects = max(max_projects, 1)
+        self.file_cache_bytes = file_cache_bytes
+        self.queue: "queue.Queue[Optional[Job]]" = queue.Queue(maxsize=queue_size)
+        self.jobs: Dict[str, Job] = {}
+        self.contexts: "OrderedDict[str, ProjectContext]" = OrderedDict()
+        # 同じプロジェクトのジョブはdocumentフォルダを共有するため直列に実行する
+        # （設定の更新でコンテキストを作り直しても同じロックを使い続ける）
+        self.project_locks: Dict[str, threading.Lock] = {}
+        self.response_cache = ResponseCache()
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"job-worker-{i + 1}", daemon=True)
+            for i in range(max(workers, 1))
+        ]
+        for worker in self._workers:
+            worker.start()
+        logger.info(f"Job service started with {len(self._workers)} workers (queue size: {queue_size})")
+
+    @property
+    def worker_count(self) -> int:
+        """ワーカースレッド数"""
+        return len(self._workers)
+
+    def _get_context(self, project_root: str) -> ProjectContext:
+        """プロジェクトのコンテキストを取得（設定が更新されていれば作り直す）"""
+        # プロジェクト直下に settings.ini があればそれを優先する
+        local_settings = os.path.join(project_root, 'settings.ini')
+        settings_path = local_settings if os.path.exists(local_settings) else self.settings_path
+        with self._lock:
+            context = self.contexts.get(project_root)
+            if context is None or context.settings_path != settings_path or context.is_stale():
+                context = ProjectContext(project_root, settings_path, self.file_cache_bytes)
+                self.contexts[project_root] = context
+            self.contexts.move_to_end(project_root)
+            while len(self.contexts) > self.max_projects:
+                evicted_root, _ = self.contexts.popitem(last=False)
+                logger.info(f"Dropped warm cache for {evicted_root}")
+            return context
+
+    def is_allowed_root(self, project_root: str) -> bool:
+        """ジョブを受け付けるプロジェクトか判定（許可リストが空の場合は全て許可）"""
+        if not self.allowed_roots:
+            return True
+        real_root = os.path.realpath(project_root)
+        return any(
+            real_root == root or real_root.startswith(root.rstrip(os.sep) + os.sep)
+            for root in self.allowed_roots
+        )
+
+    def _get_project_lock(self, project_root: str) -> threading.Lock:
+        """プロジェクトごとのロックを取得"""
+        with self._lock:
+            return self.project_locks.setdefault(project_root, threading.Lock())
+
+    def submit(self, job_type: str, project_root: str, base_ref: Optional[str] = None) -> Job:
+        """ジョブをキューに投入（キューが満杯の場合は queue.Full）"""
+        job = Job(job_type, project_root, base_ref)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._trim_finished_jobs()
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self.jobs[job.id]
+            raise
+        logger.info(f"Job {job.id} queued: {job_type} for {project_root}")
+        return job
+
+    def _trim_finished_jobs(self) -> None:
+        """古い完了済みジョブを削除"""
+        finished = [job for job in self.jobs.values() if job.finished_at]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """ジョブを取得"""
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> list:
+        """全ジョブのステータスを取得"""
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job.to_dict() for job in sorted(jobs, key=lambda j: j.submitted_at)]
+
+    def _execute(self, job: Job, context: ProjectContext):
+        """ジョブ種別に応じて処理を実行"""
+        if job.type == 'merge':
+            return merge_py_files(job.base_ref, settings=context.settings, file_cache=context.file_cache)
+
+        llm_options = {
+            'settings': context.settings,
+            'client': context.client(),
+            'response_cache': self.response_cache
+        }
+        if job.type == 'spec':
+            return generate_specification(**llm_options) or None
+        if job.type == 'detailed':
+            return generate_detailed_specification(**llm_options)
+        if job.type == 'refactoring':
+            return generate_refactoring_suggestions(job.base_ref, **llm_options)
+        if job.type == 'pipeline':
+            return list(context.runner(self.response_cache).run())
+        if job.type == 'dry_run':
+            planner = DryRunPlanner(context.runner(self.response_cache))
+            estimates = planner.estimate()
+            return planner.render_report(estimates) if estimates is not None else None
+        raise ValueError(f"Unknown job type: {job.type}")
+
+    def _worker(self) -> None:
+        """キューからジョブを取り出して実行し続ける"""
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                break
+            try:
+                with self._get_project_lock(job.project_root):
+                    context = self._get_context(job.project_root)
+                    job.status = 'running'
+                    job.started_at = time.time()
+                    job.result = self._execute(job, context)
+                # パイプラインは全ステージの出力が揃った場合のみ完了とする
+                succeeded = all(job.result) if isinstance(job.result, list) else bool(job.result)
+                job.status = 'completed' if succeeded else 'failed'
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                job.error = str(e)
+                job.status = 'failed'
+            finally:
+                job.finished_at = time.time()
+                logger.info(f"Job {job.id} {job.status} in {job.finished_at - (job.started_at or job.finished_at):.1f}s")
+                self.queue.task_done()
+
+    def shutdown(self) -> None:
+        """ワーカーを停止"""
+        for _ in self._workers:
+            self.queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """ジョブ投入・ステータス照会のHTTPハンドラ"""
+
+    service: JobService = None
+
+    def _send_json(self, status: int, payload) -> None:
+        """JSONレスポンスを返す"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Tuple[Optional[Dict], Optional[str]]:
+        """リクエストボディをJSONとして読み込む"""
+        # ブラウザからの単純リクエスト（text/plain等）を受け付けないようにする
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            return None, "Content-Type must be application/json"
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+            if not isinstance(payload, dict):
+                return None, "request body must be a JSON object"
+            return payload, None
+        except (ValueError, UnicodeDecodeError) as e:
+            return None, f"invalid JSON: {e}"
+
+    def do_GET(self) -> None:
+        """ジョブ・サービスの状態を返す"""
+        path = self.path.rstrip('/')
+        if path == '/health':
+            self._send_json(200, {
+                'status': 'ok',
+                'workers': self.service.worker_count,
+                'queued': self.service.queue.qsize(),
+                'projects': len(self.service.contexts)
+            })
+        elif path == '/metrics':
+            self._send_json(200, {
+                'models': usage_tracker.snapshot(),
+                'response_cache': {'hits': self.service.response_cache.hits,
+                                   'misses': self.service.response_cache.misses}
+            })
+        elif path == '/jobs':
+            self._send_json(200, self.service.list_jobs())
+        elif path.startswith('/jobs/'):
+            job = self.service.get(path[len('/jobs/'):])
+            if job is None:
+                self._send_json(404, {'error': 'job not found'})
+            else:
+                self._send_json(200, job.to_dict())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self) -> None:
+        """ジョブを投入"""
+        if self.path.rstrip('/') != '/jobs':
+            self._send_json(404, {'error': 'not found'})
+            return
+        payload, error = self._read_json()
+        if error:
+            self._send_json(415 if error.startswith('Content-Type') else 400, {'error': error})
+            return
+
+        job_type = payload.get('type')
+        project_root = payload.get('project_root')
+        if job_type not in JOB_TYPES:
+            self._send_json(400, {'error': f"type must be one of {', '.join(JOB_TYPES)}"})
+            return
+        if not project_root or not os.path.isdir(project_root):
+            self._send_json(400, {'error': 'project_root must be an existing directory'})
+            return
+        if not self.service.is_allowed_root(project_root):
+            self._send_json(403, {'error': 'project_root is not in the allowed roots'})
+            return
+        base_ref = payload.get('base_ref')
+        if base_ref is not None and not is_safe_ref(base_ref):
+            self._send_json(400, {'error': 'base_ref must be a git reference that does not start with "-"'})
+            return
+
+        try:
+            job = self.service.submit(job_type, os.path.abspath(project_root), base_ref)
+        except queue.Full:
+            self._send_json(503, {'error': 'job queue is full'})
+            return
+        self._send_json(202, job.to_dict())
+
+    def log_message(self, format: str, *args) -> None:
+        """アクセスログをloggingに出力"""
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+def run_server(settings_path: str = 'settings.ini', port: Optional[int] = None) -> None:
+    """常駐サーバーのエントリーポイント"""
+    settings = utils.read_settings(settings_path)
+    host = settings.get('server_host') or '127.0.0.1'
+    port = port or utils.get_int_setting(settings, 'server_port', 8765)
+    service = JobService(
+        settings_path,
+        workers=utils.get_int_setting(settings, 'server_workers', 2),
+        queue_size=utils.get_int_setting(settings, 'server_queue_size', 100),
+        allowed_roots=[root.strip() for root in settings.get('server_allowed_roots', '').split(',') if root.strip()],
+        max_projects=utils.get_int_setting(settings, 'server_max_projects', 8),
+        file_cache_bytes=utils.get_int_setting(settings, 'server_file_cache_mb', 64) * 1024 * 1024
+    )
+    JobRequestHandler.service = service
+    httpd = ThreadingHTTPServer((host, port), JobRequestHandler)
+    logger.info(f"Serving on http://{host}:{port}")
+    print(f"サーバーを起動しました: http://{host}:{port} （Ctrl+C で停止）")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down server")
+    finally:
+        httpd.server_close()
+        service.shutdown()
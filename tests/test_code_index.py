@@ -0,0 +1,87 @@
+import os
+from code_index import CodeIndex, tokenize, build_focused_context
+from utils import estimate_tokens
+
+SOURCE = '''
+def read_settings(path):
+    """設定ファイルを読み込む"""
+    return open(path).read()
+
+def write_report(report):
+    print(report)
+
+class ReportWriter:
+    def write(self, report):
+        write_report(report)
+'''
+
+def _make_index(tmp_path, files):
+    project = tmp_path / "project"
+    project.mkdir()
+    for name, content in files.items():
+        (project / name).write_text(content, encoding='utf-8')
+    document = tmp_path / "document"
+    document.mkdir()
+    index = CodeIndex(str(document))
+    index.update(str(project), [])
+    return index, project, document
+
+def test_tokenize_splits_identifiers_and_non_ascii_text():
+    assert tokenize("readSettings") == ["readsettings", "read", "settings"]
+    assert tokenize("write_report") == ["write_report", "write", "report"]
+    assert tokenize("設定") == ["設定"]
+    assert tokenize("設定ファイル") == ["設定", "定フ", "ファ", "ァイ", "イル"]
+    assert tokenize("self and x") == []
+
+def test_search_ranks_the_matching_function_first(tmp_path):
+    index, _, _ = _make_index(tmp_path, {"app.py": SOURCE})
+    results = index.search("read settings", top_k=3)
+    assert results[0][0]['qualname'] == "read_settings"
+    assert all(score > 0 for _, score in results)
+
+def test_search_matches_docstring_text(tmp_path):
+    index, _, _ = _make_index(tmp_path, {"app.py": SOURCE})
+    assert index.search("設定ファイル", top_k=1)[0][0]['qualname'] == "read_settings"
+
+def test_search_respects_top_k_and_unknown_terms(tmp_path):
+    index, _, _ = _make_index(tmp_path, {"app.py": SOURCE})
+    assert len(index.search("report write", top_k=1)) == 1
+    assert index.search("nonexistentterm") == []
+
+def test_index_is_persisted_and_only_changed_files_are_reindexed(tmp_path):
+    index, project, document = _make_index(tmp_path, {"app.py": SOURCE, "other.py": "def helper():\n    pass\n"})
+    assert os.path.exists(document / "code_index.json")
+
+    reloaded = CodeIndex(str(document))
+    assert reloaded.search("read settings")[0][0]['qualname'] == "read_settings"
+    assert reloaded.update(str(project), []) == 0
+
+    (project / "other.py").write_text("def load_config():\n    pass\n", encoding='utf-8')
+    assert reloaded.update(str(project), []) == 1
+    assert reloaded.search("load config")[0][0]['qualname'] == "load_config"
+    assert reloaded.search("helper") == []
+
+def test_removed_files_drop_out_of_the_index(tmp_path):
+    index, project, _ = _make_index(tmp_path, {"app.py": SOURCE, "other.py": "def helper():\n    pass\n"})
+    os.remove(project / "other.py")
+    index.update(str(project), [])
+    assert index.search("helper") == []
+
+def test_focused_context_drops_lower_ranked_units_to_fit_the_budget(tmp_path):
+    project = tmp_path / "project"
+    (project / "document").mkdir(parents=True)
+    (project / "app.py").write_text(SOURCE, encoding='utf-8')
+    settings = {'source_directory': str(project), 'exclusions': ''}
+    queries = {"設定": "read settings", "出力": "write report"}
+
+    full = build_focused_context(settings, queries, top_k=3)
+    assert "省略" not in full
+
+    budget = estimate_tokens(full) - 1
+    trimmed = build_focused_context(settings, queries, top_k=3, max_tokens=budget)
+    assert estimate_tokens(trimmed) <= budget
+    assert "app.py (read_settings, line 2)" in trimmed
+    assert "app.py (write_report, line 6)" in trimmed
+    assert "件を省略" in trimmed
+
+    assert build_focused_context(settings, queries, top_k=3, max_tokens=5) is None
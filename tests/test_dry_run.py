@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip('openai')
+
+import utils
+from dry_run import DryRunPlanner
+
+class _Runner:
+    def __init__(self, settings):
+        self.settings = settings
+
+def _planner(**settings):
+    return DryRunPlanner(_Runner(dict({'openai_model': 'gpt-4', 'context_window': '8192'}, **settings)))
+
+def test_context_window_is_resolved_per_routed_model():
+    planner = _planner(spec_model='gpt-4o', model_context_windows={'GPT-4o': '128000'})
+    prompt = 'x' * 40000
+
+    spec = planner._estimate_stage('spec', '', prompt, cached=False)
+    assert spec['model'] == 'gpt-4o'
+    assert spec['context_window'] == 128000
+    assert not spec['exceeds_context']
+
+    detailed = planner._estimate_stage('detailed', '', prompt, cached=False)
+    assert detailed['context_window'] == 8192
+    assert detailed['exceeds_context']
+
+def test_invalid_context_window_falls_back_to_the_default():
+    planner = _planner(model_context_windows={'gpt-4': 'large'})
+    assert planner._estimate_stage('spec', '', 'x', cached=False)['context_window'] == 8192
+
+def test_read_settings_collects_context_windows(tmp_path):
+    path = tmp_path / "settings.ini"
+    path.write_text("[CONTEXT_WINDOWS]\ngpt-4o = 128000\n", encoding='utf-8')
+    assert utils.read_settings(str(path))['model_context_windows'] == {'gpt-4o': '128000'}
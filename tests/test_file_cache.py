@@ -0,0 +1,89 @@
+import pytest
+import os
+import utils
+from utils import FileContentCache
+
+def _write(path, content="x = 1\n"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding='utf-8')
+
+def _bump_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+def test_python_files_matches_get_python_files_and_skips_rescan(tmp_path, monkeypatch):
+    _write(tmp_path / "a.py")
+    _write(tmp_path / "pkg" / "b.py")
+    _write(tmp_path / "skip" / "c.py")
+    cache = FileContentCache()
+    expected = utils.get_python_files(str(tmp_path), ["skip"])
+    assert cache.python_files(str(tmp_path), ["skip"]) == expected
+
+    calls = []
+    original = utils.get_python_files
+    monkeypatch.setattr(utils, 'get_python_files', lambda *args: calls.append(args) or original(*args))
+    assert cache.python_files(str(tmp_path), ["skip"]) == expected
+    assert calls == []
+
+    _write(tmp_path / "pkg" / "new.py")
+    _bump_mtime(tmp_path / "pkg")
+    files = cache.python_files(str(tmp_path), ["skip"])
+    assert len(calls) == 1
+    assert os.path.join("pkg", "new.py") in [rel_path for rel_path, _ in files]
+
+def test_derived_values_are_recomputed_only_when_the_listing_changes(tmp_path):
+    _write(tmp_path / "a.py")
+    cache = FileContentCache()
+    computed = []
+    compute = lambda: computed.append(1) or len(computed)
+    assert cache.cached_for_listing(str(tmp_path), [], 'tree', compute) == 1
+    assert cache.cached_for_listing(str(tmp_path), [], 'tree', compute) == 1
+
+    _write(tmp_path / "b.py")
+    _bump_mtime(tmp_path)
+    assert cache.cached_for_listing(str(tmp_path), [], 'tree', compute) == 2
+
+def test_file_hash_is_reused_until_the_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / "a.py"
+    _write(path)
+    cache = FileContentCache()
+    first = cache.file_hash(str(path))
+    assert first == utils.hash_file(str(path))
+
+    monkeypatch.setattr(utils, 'hash_file', lambda p: 'recomputed')
+    assert cache.file_hash(str(path)) == first
+
+    _write(path, "x = 2\n")
+    _bump_mtime(path)
+    assert cache.file_hash(str(path)) == 'recomputed'
+    assert cache.file_hash(str(tmp_path / "missing.py")) is None
+
+def test_contents_are_evicted_least_recently_used_first(tmp_path):
+    paths = []
+    for name in ("a.py", "b.py", "c.py"):
+        _write(tmp_path / name, "x" * 100)
+        paths.append(str(tmp_path / name))
+    cache = FileContentCache(max_bytes=250)
+    cache.read(paths[0])
+    cache.read(paths[1])
+    cache.read(paths[0])
+    cache.read(paths[2])
+    assert cache.total_bytes == 200
+    assert list(cache._entries) == [os.path.abspath(paths[0]), os.path.abspath(paths[2])]
+
+def test_files_larger_than_the_limit_are_not_cached(tmp_path):
+    _write(tmp_path / "big.py", "x" * 500)
+    cache = FileContentCache(max_bytes=100)
+    assert cache.read(str(tmp_path / "big.py"))[0] == "x" * 500
+    assert cache.total_bytes == 0
+
+def test_read_with_digest_reads_once_and_shares_the_hash(tmp_path, monkeypatch):
+    _write(tmp_path / "a.py", "x = 'é'\n")
+    cache = FileContentCache()
+    result = cache.read_with_digest(str(tmp_path / "a.py"))
+    assert result == utils.read_file_with_digest(str(tmp_path / "a.py"))
+
+    monkeypatch.setattr(utils, 'read_file_with_digest', lambda path: pytest.fail("file was re-read"))
+    monkeypatch.setattr(utils, 'hash_file', lambda path: pytest.fail("file was re-hashed"))
+    assert cache.read(str(tmp_path / "a.py")) == result[:2]
+    assert cache.file_hash(str(tmp_path / "a.py")) == result[2]
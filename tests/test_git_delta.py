@@ -0,0 +1,62 @@
+import os
+import shutil
+import subprocess
+import pytest
+from git_delta import get_changed_files, resolve_ref
+
+pytestmark = pytest.mark.skipif(shutil.which('git') is None, reason="git is not installed")
+
+def _git(repo, *args):
+    subprocess.run(
+        ['git', '-C', str(repo), '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args),
+        check=True, capture_output=True
+    )
+
+def _write(repo, rel_path, content="x = 1\n"):
+    path = repo / rel_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding='utf-8')
+
+@pytest.fixture
+def repo(tmp_path):
+    _git(tmp_path, 'init', '-q')
+    for rel_path in ('unchanged.py', 'committed.py', 'modified.py', 'old_name.py', 'pkg/deleted.py'):
+        _write(tmp_path, rel_path, f"# {rel_path}\n" + "value = 1\n" * 20)
+    _git(tmp_path, 'add', '-A')
+    _git(tmp_path, 'commit', '-q', '-m', 'base')
+    _git(tmp_path, 'tag', 'base')
+    return tmp_path
+
+def test_reports_committed_uncommitted_untracked_renamed_and_non_ascii_files(repo):
+    _write(repo, 'committed.py', "changed = True\n")
+    _git(repo, 'commit', '-q', '-am', 'change')
+    _write(repo, 'modified.py', "changed = True\n")
+    _git(repo, 'mv', 'old_name.py', 'pkg/new_name.py')
+    _git(repo, 'rm', '-q', 'pkg/deleted.py')
+    _write(repo, 'untracked.py')
+    _write(repo, '日本語.py')
+    _write(repo, 'pkg/モジュール.py')
+    _write(repo, 'notes.txt')
+
+    changed = get_changed_files(str(repo), 'base', [])
+    assert sorted(changed) == sorted([
+        'committed.py', 'modified.py', 'pkg/new_name.py', 'untracked.py', '日本語.py', 'pkg/モジュール.py'
+    ])
+
+def test_exclusions_apply_to_changed_files(repo):
+    _write(repo, 'build/generated.py')
+    _write(repo, 'kept.py')
+    assert get_changed_files(str(repo), 'base', ['build']) == ['kept.py']
+
+def test_no_changes(repo):
+    assert get_changed_files(str(repo), 'HEAD', []) == []
+
+def test_refs_that_look_like_options_are_rejected(repo, tmp_path):
+    target = tmp_path / 'pwned'
+    assert resolve_ref(str(repo), f'--output={target}') is None
+    assert get_changed_files(str(repo), f'--output={target}', []) is None
+    assert not target.exists()
+
+def test_unknown_ref(repo):
+    assert resolve_ref(str(repo), 'no-such-ref') is None
+    assert get_changed_files(str(repo), 'no-such-ref', []) is None
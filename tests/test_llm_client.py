@@ -0,0 +1,28 @@
+from llm_client import ModelRouter
+
+def test_falls_back_to_openai_model():
+    router = ModelRouter({'openai_model': 'base-model'})
+    assert router.model_for('spec') == 'base-model'
+    assert router.model_for('detailed', 'repair') == 'base-model'
+
+def test_default_model_when_nothing_is_configured():
+    assert ModelRouter({}).model_for('spec') == 'gpt-4'
+
+def test_tiers_route_generation_and_repair():
+    router = ModelRouter({'openai_model': 'base-model', 'fast_model': 'fast', 'strong_model': 'strong'})
+    assert router.model_for('spec') == 'strong'
+    assert router.model_for('refactoring', 'repair') == 'fast'
+
+def test_stage_model_applies_only_to_generation():
+    router = ModelRouter({'openai_model': 'base-model', 'fast_model': 'fast', 'refactoring_model': 'stage'})
+    assert router.model_for('refactoring') == 'stage'
+    assert router.model_for('refactoring', 'repair') == 'fast'
+    assert router.model_for('spec') == 'base-model'
+
+def test_task_model_overrides_tier():
+    router = ModelRouter({'fast_model': 'fast', 'repair_model': 'repairer', 'detailed_model': 'stage'})
+    assert router.model_for('detailed', 'repair') == 'repairer'
+
+def test_blank_settings_are_ignored():
+    router = ModelRouter({'openai_model': 'base-model', 'strong_model': '  ', 'spec_model': ''})
+    assert router.model_for('spec') == 'base-model'
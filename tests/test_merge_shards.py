@@ -0,0 +1,92 @@
+import os
+import utils
+from merge_shards import ShardWriter, load_shard_index, open_shard_writer
+
+def _block(rel_path, lines=10):
+    return utils.format_file_block(rel_path, "x = 1\n" * lines)
+
+def _write(tmp_path, paths, **limits):
+    writer = ShardWriter(str(tmp_path), 'merge.txt', **limits)
+    for rel_path in paths:
+        writer.add_file(rel_path, _block(rel_path))
+    assert writer.close() is not None
+    return load_shard_index(str(tmp_path), 'merge.txt')
+
+def _shard_files(index):
+    return [shard['files'] for shard in index['shards']]
+
+BLOCK_BYTES = len(_block("pkg/a.py").encode('utf-8'))
+
+def test_sharding_is_disabled_without_limits(tmp_path):
+    assert open_shard_writer({'output_file': 'merge.txt'}, str(tmp_path)) is None
+    writer = open_shard_writer({'output_file': 'merge.txt', 'shard_max_tokens': '100'}, str(tmp_path))
+    assert writer.max_tokens == 100 and writer.max_bytes == 0
+
+def test_shards_split_only_on_file_boundaries(tmp_path):
+    paths = ["a.py", "b.py", "c.py"]
+    index = _write(tmp_path, paths, max_bytes=BLOCK_BYTES * 2 + 100)
+    assert _shard_files(index) == [["a.py", "b.py"], ["c.py"]]
+    assert index['total_files'] == 3
+    for shard in index['shards']:
+        content = (tmp_path / shard['file']).read_text(encoding='utf-8')
+        assert len(content.encode('utf-8')) == shard['bytes'] <= BLOCK_BYTES * 2 + 100
+        assert all(f"File: {path}\n" in content for path in shard['files'])
+
+def test_directory_that_does_not_fit_starts_a_new_shard(tmp_path):
+    index = _write(tmp_path, ["a.py", "pkg/b.py", "pkg/c.py"], max_bytes=BLOCK_BYTES * 2 + 100)
+    assert _shard_files(index) == [["a.py"], ["pkg/b.py", "pkg/c.py"]]
+    assert index['shards'][1]['directories'] == ["pkg"]
+
+def test_oversized_directory_is_split_across_shards(tmp_path):
+    paths = [f"pkg/m{i}.py" for i in range(5)]
+    index = _write(tmp_path, ["a.py"] + paths, max_bytes=BLOCK_BYTES * 2 + 100)
+    assert sum(_shard_files(index), []) == ["a.py"] + paths
+    assert all(len(files) <= 2 for files in _shard_files(index))
+
+def test_oversized_directory_is_not_buffered_entirely(tmp_path):
+    writer = ShardWriter(str(tmp_path), 'merge.txt', max_bytes=BLOCK_BYTES * 2 + 100)
+    for i in range(10):
+        writer.add_file(f"pkg/m{i}.py", _block(f"pkg/m{i}.py"))
+        assert len(writer._group) <= 2
+    writer.close()
+
+def test_single_file_larger_than_the_limit_gets_its_own_shard(tmp_path):
+    index = _write(tmp_path, ["a.py", "big.py"], max_bytes=BLOCK_BYTES // 2)
+    assert _shard_files(index) == [["a.py"], ["big.py"]]
+
+def test_token_limit(tmp_path):
+    tokens = utils.estimate_tokens(_block("a.py"))
+    index = _write(tmp_path, ["a.py", "b.py", "c.py", "d.py"], max_tokens=tokens * 2 + 20)
+    assert _shard_files(index) == [["a.py", "b.py"], ["c.py", "d.py"]]
+
+def test_stale_shards_are_removed(tmp_path):
+    _write(tmp_path, ["a.py", "b.py", "c.py"], max_bytes=BLOCK_BYTES)
+    assert os.path.exists(tmp_path / "merge-0003.txt")
+    _write(tmp_path, ["a.py"], max_bytes=BLOCK_BYTES)
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith("merge-0")) == ["merge-0001.txt"]
+
+def test_failed_write_leaves_no_files(tmp_path):
+    writer = ShardWriter(str(tmp_path), 'merge.txt', max_bytes=BLOCK_BYTES)
+    writer.add_file("a.py", _block("a.py"))
+    writer.add_file("b.py", _block("b.py"))
+    assert writer.close(success=False) is None
+    assert os.listdir(tmp_path) == []
+
+def test_merge_keeps_package_files_together_in_shards(tmp_path):
+    from merge_files import PythonFileMerger
+    project = tmp_path / "project"
+    for rel_path in ("a.py", "pkg/a.py", "pkg/sub/b.py", "pkg/sub/c.py", "pkg/sub/d.py", "pkg/z.py"):
+        path = project / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("x = 1\n" * 10, encoding='utf-8')
+    settings = utils.read_settings(str(tmp_path / "missing.ini"))
+    settings.update({'source_directory': str(project), 'shard_max_bytes': str(BLOCK_BYTES * 3 + 100)})
+
+    merger = PythonFileMerger(settings=settings)
+    assert merger.process()
+    index = load_shard_index(merger.output_dir, 'merge.txt')
+    assert _shard_files(index) == [["a.py", "pkg/a.py", "pkg/z.py"], ["pkg/sub/b.py", "pkg/sub/c.py", "pkg/sub/d.py"]]
+
+    merged = (project / "document" / "merge.txt").read_text(encoding='utf-8')
+    order = [merged.index(f"File: {path}\n") for path in ("pkg/a.py", "pkg/z.py", "pkg/sub/b.py")]
+    assert order == sorted(order)
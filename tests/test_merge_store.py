@@ -0,0 +1,69 @@
+import json
+import hashlib
+import pytest
+import utils
+from merge_store import MergeStoreWriter, MergeStoreReader, store_path
+
+FILES = {
+    "a.py": "def alpha():\n    return 1\n",
+    "pkg/b.py": "class Beta:\n    def run(self):\n        return '日本語'\n",
+    "pkg/c.py": "GAMMA = 3\n",
+    "pkg/sub/d.py": "def delta(x):\n    return x\n",
+}
+
+def _write_store(tmp_path, store_format, compression):
+    path = store_path(str(tmp_path), "merge.txt", store_format)
+    writer = MergeStoreWriter(path, store_format, compression)
+    for rel_path, content in FILES.items():
+        source = tmp_path / "src" / rel_path
+        source.parent.mkdir(parents=True, exist_ok=True)
+        source.write_bytes(content.encode('utf-8'))
+        writer.add_file(rel_path, *utils.read_file_with_digest(str(source)))
+    assert writer.close() == path
+    return path
+
+@pytest.mark.parametrize("store_format", ["sqlite", "jsonl"])
+@pytest.mark.parametrize("compression", ["none", "gzip", "lzma"])
+def test_reader_round_trips_files_and_pages(tmp_path, store_format, compression):
+    reader = MergeStoreReader(_write_store(tmp_path, store_format, compression))
+
+    assert reader.list_files() == sorted(FILES)
+    for rel_path, content in FILES.items():
+        record = reader.get_file(rel_path)
+        assert record['content'] == content
+        assert record['sha256'] == hashlib.sha256(content.encode('utf-8')).hexdigest()
+        assert record['size'] == len(content.encode('utf-8'))
+        assert record['compression'] == compression
+    assert reader.get_file("missing.py") is None
+    assert [s['name'] for s in reader.get_file("pkg/b.py")['symbols']][:1] == ["Beta"]
+
+    assert [r['path'] for r in reader.iter_files("pkg/*.py")] == ["pkg/b.py", "pkg/c.py", "pkg/sub/d.py"]
+    assert [r['path'] for r in reader.iter_files("pkg/*.py", offset=1, limit=1)] == ["pkg/c.py"]
+    assert [r['path'] for r in reader.iter_files(offset=3, limit=5)] == ["pkg/sub/d.py"]
+    assert list(reader.iter_files(limit=0)) == []
+    metadata = list(reader.iter_files(with_content=False))
+    assert len(metadata) == len(FILES) and all('content' not in r for r in metadata)
+
+def test_jsonl_stores_compressed_content_as_base64(tmp_path):
+    path = _write_store(tmp_path, "jsonl", "gzip")
+    with open(path, encoding='utf-8') as f:
+        record = json.loads(f.readline())
+    assert record['path'] == "a.py"
+    assert record['content'] != FILES["a.py"]
+    assert MergeStoreReader(path).get_file("a.py")['content'] == FILES["a.py"]
+
+def test_hash_and_size_come_from_the_original_bytes(tmp_path):
+    source = tmp_path / "legacy.py"
+    raw = "# 設定\r\nX = 1\r\n".encode('cp932')
+    source.write_bytes(raw)
+    content, encoding, sha256, size = utils.read_file_with_digest(str(source))
+    assert (content, encoding) == ("# 設定\nX = 1\n", 'cp932')
+
+    path = store_path(str(tmp_path), "merge.txt", "sqlite")
+    writer = MergeStoreWriter(path, "sqlite")
+    writer.add_file("legacy.py", content, encoding, sha256, size)
+    writer.close()
+    record = MergeStoreReader(path).get_file("legacy.py")
+    assert record['sha256'] == hashlib.sha256(raw).hexdigest()
+    assert record['size'] == len(raw)
+    assert record['content'] == content
@@ -0,0 +1,111 @@
+import os
+import json
+import pytest
+
+pytest.importorskip('openai')
+
+import utils
+import pipeline
+from pipeline import PipelineRunner, MANIFEST_FILENAME
+
+STAGE_OUTPUTS = {
+    'spec': 'requirements_spec.txt',
+    'detailed': 'detailed_spec.txt',
+    'refactoring': 'check_refactoring.txt'
+}
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    (project_dir / "app.py").write_text("def main():\n    pass\n", encoding='utf-8')
+    monkeypatch.chdir(project_dir)
+
+    calls = []
+    results = {}
+
+    def make_stage(stage):
+        def run_stage(settings=None, **kwargs):
+            calls.append(stage)
+            if results.get(stage) is False:
+                return None
+            # 生成処理と同様に source_directory 基準の（相対の場合もある）パスを返す
+            path = os.path.join(settings['source_directory'], 'document', STAGE_OUTPUTS[stage])
+            utils.write_file_content(path, f"{stage} output {len(calls)}")
+            return path
+        return run_stage
+
+    monkeypatch.setattr(pipeline, 'generate_specification', make_stage('spec'))
+    monkeypatch.setattr(pipeline, 'generate_detailed_specification', make_stage('detailed'))
+    monkeypatch.setattr(pipeline, 'generate_refactoring_suggestions', make_stage('refactoring'))
+    return project_dir, calls, results
+
+def _settings(source_directory='.', **overrides):
+    settings = utils.read_settings(os.path.join(os.sep, 'nonexistent', 'settings.ini'))
+    settings['source_directory'] = source_directory
+    settings.update(overrides)
+    return settings
+
+def test_second_run_skips_every_stage(project):
+    project_dir, calls, _ = project
+    first = PipelineRunner(settings=_settings()).run()
+    assert calls == ['spec', 'detailed', 'refactoring']
+    assert all(path and os.path.isabs(path) for path in first)
+
+    second = PipelineRunner(settings=_settings()).run()
+    assert calls == ['spec', 'detailed', 'refactoring']
+    assert second == first
+
+def test_manifest_paths_are_absolute_and_valid_from_another_cwd(project, tmp_path, monkeypatch):
+    project_dir, calls, _ = project
+    PipelineRunner(settings=_settings('.')).run()
+    manifest = json.loads((project_dir / 'document' / MANIFEST_FILENAME).read_text(encoding='utf-8'))
+    assert all(os.path.isabs(entry['output_path']) for entry in manifest['stages'].values())
+
+    # 別のカレントディレクトリから絶対パスで同じプロジェクトを実行してもスキップされる
+    monkeypatch.chdir(tmp_path)
+    paths = PipelineRunner(settings=_settings(str(project_dir))).run()
+    assert calls == ['spec', 'detailed', 'refactoring']
+    assert paths[1] == str(project_dir / 'document' / STAGE_OUTPUTS['spec'])
+
+def test_relative_paths_in_old_manifests_are_treated_as_stale(project):
+    project_dir, calls, _ = project
+    PipelineRunner(settings=_settings()).run()
+    manifest_path = project_dir / 'document' / MANIFEST_FILENAME
+    manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+    manifest['stages']['spec']['output_path'] = os.path.join('.', 'document', STAGE_OUTPUTS['spec'])
+    manifest_path.write_text(json.dumps(manifest), encoding='utf-8')
+
+    PipelineRunner(settings=_settings()).run()
+    assert calls == ['spec', 'detailed', 'refactoring', 'spec', 'detailed']
+
+def test_source_change_reruns_all_stages(project):
+    project_dir, calls, _ = project
+    PipelineRunner(settings=_settings()).run()
+    (project_dir / "app.py").write_text("def main():\n    return 1\n", encoding='utf-8')
+    PipelineRunner(settings=_settings()).run()
+    assert calls == ['spec', 'detailed', 'refactoring'] * 2
+
+def test_modified_output_reruns_only_that_stage(project):
+    project_dir, calls, _ = project
+    PipelineRunner(settings=_settings()).run()
+    (project_dir / 'document' / STAGE_OUTPUTS['refactoring']).write_text("edited", encoding='utf-8')
+    PipelineRunner(settings=_settings()).run()
+    assert calls == ['spec', 'detailed', 'refactoring', 'refactoring']
+
+def test_stage_setting_change_reruns_only_that_stage(project):
+    _, calls, _ = project
+    PipelineRunner(settings=_settings()).run()
+    PipelineRunner(settings=_settings(refactoring_model='other-model')).run()
+    assert calls == ['spec', 'detailed', 'refactoring', 'refactoring']
+
+def test_failed_stage_blocks_dependents_and_is_retried(project):
+    _, calls, results = project
+    results['spec'] = False
+    paths = PipelineRunner(settings=_settings()).run()
+    assert paths[1] is None and paths[2] is None
+    assert calls == ['spec', 'refactoring']
+
+    results['spec'] = True
+    PipelineRunner(settings=_settings()).run()
+    assert calls == ['spec', 'refactoring', 'spec', 'detailed']
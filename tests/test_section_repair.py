@@ -0,0 +1,96 @@
+from section_repair import (
+    SectionRepairer, extract_sections, find_incomplete_sections, splice_section
+)
+
+SECTIONS = ["# 仕様書", "## 1. 概要", "## 2. 機能", "## 3. 要件"]
+
+COMPLETE = """# 仕様書
+
+## 1. 概要
+概要の本文
+
+## 2. 機能
+機能の本文
+
+## 3. 要件
+要件の本文
+"""
+
+def test_complete_document_has_no_incomplete_sections():
+    assert find_incomplete_sections(COMPLETE, SECTIONS) == []
+
+def test_missing_section_is_reported():
+    content = COMPLETE.replace("## 2. 機能\n機能の本文\n\n", "")
+    assert find_incomplete_sections(content, SECTIONS) == ["## 2. 機能"]
+
+def test_empty_and_placeholder_bodies_are_reported():
+    content = COMPLETE.replace("機能の本文", "").replace("要件の本文", "[具体的な内容]")
+    assert find_incomplete_sections(content, SECTIONS) == ["## 2. 機能", "## 3. 要件"]
+
+def test_title_only_needs_to_exist():
+    content = COMPLETE.replace("# 仕様書\n\n", "")
+    assert find_incomplete_sections(content, SECTIONS) == ["# 仕様書"]
+    assert find_incomplete_sections("# 仕様書\n" + content, SECTIONS) == []
+
+def test_heading_with_trailing_text_matches():
+    content = COMPLETE.replace("## 1. 概要", "## 1. 概要（補足あり）")
+    assert find_incomplete_sections(content, SECTIONS) == []
+
+def test_out_of_order_sections_are_complete():
+    content = "# 仕様書\n\n## 3. 要件\n要件\n\n## 1. 概要\n概要\n\n## 2. 機能\n機能\n"
+    assert find_incomplete_sections(content, SECTIONS) == []
+    assert extract_sections(content, SECTIONS[1:]) == {
+        "## 1. 概要": "概要", "## 2. 機能": "機能", "## 3. 要件": "要件"
+    }
+
+def test_sub_headings_belong_to_the_enclosing_section():
+    content = COMPLETE.replace("機能の本文", "### 2.1 詳細\n詳細の本文")
+    assert find_incomplete_sections(content, SECTIONS) == []
+    assert extract_sections(content, SECTIONS[1:])["## 2. 機能"] == "### 2.1 詳細\n詳細の本文"
+
+def test_deeper_heading_with_the_same_text_does_not_count():
+    content = COMPLETE.replace("## 1. 概要", "### 1. 概要")
+    assert find_incomplete_sections(content, SECTIONS) == ["## 1. 概要"]
+
+def test_splice_replaces_an_empty_section_in_place():
+    content = COMPLETE.replace("機能の本文", "")
+    repaired = splice_section(content, SECTIONS, "## 2. 機能", "新しい本文")
+    assert repaired.index("## 1. 概要") < repaired.index("新しい本文") < repaired.index("## 3. 要件")
+    assert find_incomplete_sections(repaired, SECTIONS) == []
+
+def test_splice_inserts_a_missing_section_before_the_next_one():
+    content = COMPLETE.replace("## 2. 機能\n機能の本文\n\n", "")
+    repaired = splice_section(content, SECTIONS, "## 2. 機能", "追加の本文")
+    assert repaired.index("概要の本文") < repaired.index("## 2. 機能") < repaired.index("## 3. 要件")
+    assert find_incomplete_sections(repaired, SECTIONS) == []
+
+def test_splice_appends_a_missing_last_section():
+    content = COMPLETE.replace("## 3. 要件\n要件の本文\n", "")
+    repaired = splice_section(content, SECTIONS, "## 3. 要件", "末尾の本文")
+    assert repaired.endswith("## 3. 要件\n末尾の本文\n")
+    assert find_incomplete_sections(repaired, SECTIONS) == []
+
+def test_extract_sections_skips_missing_and_empty_sections():
+    reply = "前置き\n\n## 2. 機能\n\n## 3. 要件\n要件の本文\n"
+    assert extract_sections(reply, ["## 1. 概要", "## 2. 機能", "## 3. 要件"]) == {"## 3. 要件": "要件の本文"}
+
+def test_repairer_only_requests_incomplete_sections():
+    content = COMPLETE.replace("機能の本文", "").replace("## 3. 要件\n要件の本文\n", "")
+    prompts = []
+
+    def request_fn(prompt):
+        prompts.append(prompt)
+        return "## 2. 機能\n機能の本文\n\n## 3. 要件\n要件の本文"
+
+    repaired, metrics = SectionRepairer(SECTIONS, request_fn, max_attempts=2).repair(content, "code")
+    assert find_incomplete_sections(repaired, SECTIONS) == []
+    assert len(prompts) == 1
+    assert metrics['repaired_sections'] == 2
+
+def test_repairer_stops_after_max_attempts():
+    content = COMPLETE.replace("機能の本文", "")
+    calls = []
+    repaired, metrics = SectionRepairer(SECTIONS, lambda prompt: calls.append(prompt) or "", 3).repair(content, "code")
+    assert repaired == content
+    assert len(calls) == 3
+    assert metrics['repaired_sections'] == 0
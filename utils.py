@@ -1,11 +1,19 @@
 import os
 import logging
+import re
+import hashlib
 import fnmatch
 import configparser
-from typing import List, Tuple, Optional, Dict
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import IO, Callable, Iterator, List, Tuple, Optional, Dict, TypeVar
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
 def normalize_path(path: str) -> str:
     """パスを正規化"""
     return os.path.normpath(path).replace('\\', '/')
@@ -20,8 +28,90 @@ def read_settings(settings_path: str = 'settings.ini') -> dict:
             'source_directory': '.',
             'output_file': 'merge.txt',
             'exclusions': 'myenv,*__pycache__*,sample_file,*.log',
+            # 構造化ストアの形式（none / sqlite / jsonl）と内容の圧縮方式（none / gzip / lzma）
+            'structured_store': 'none',
+            'store_compression': 'none',
+            # シャード出力の上限（バイト数・推定トークン数、0 は無効）
+            'shard_max_bytes': '0',
+            'shard_max_tokens': '0',
             'openai_api_key': '',
-            'openai_model': 'gpt-4'
+            'openai_model': 'gpt-4',
+            # ステージ・タスクごとのモデル（空欄は openai_model を使用）
+            'fast_model': '',
+            'strong_model': '',
+            'spec_model': '',
+            'detailed_model': '',
+            'refactoring_model': '',
+            'repair_model': '',
+            # ステージごとのトークン予算（0 は無制限）
+            'spec_token_budget': '0',
+            'detailed_token_budget': '0',
+            'refactoring_token_budget': '0',
+            # 欠落セクションの再生成を試みる上限回数
+            'max_repair_attempts': '2',
+            # 観点ごとに抽出する関連コード単位の数（0 は全コードを送信）
+            'retrieval_top_k': '0',
+            # ドライランでの見積もり条件
+            'input_cost_per_1k': '0.03',
+            'output_cost_per_1k': '0.06',
+            'context_window': '8192',
+            'expected_output_tokens': '2000',
+            'output_tokens_per_second': '20',
+            'request_overhead_seconds': '2',
+            'requests_per_minute': '60',
+            'tokens_per_minute': '0',
+            # 常駐サーバーの設定
+            'server_host': '127.0.0.1',
+            'server_port': '8765',
+            'server_workers': '2',
+            'server_queue_size': '100',
+            # ジョブを受け付けるプロジェクトのルート（カンマ区切り、空欄は制限なし）
+            'server_allowed_roots': '',
+            # ウォームキャッシュを保持するプロジェクト数とプロジェクトごとの読み込みキャッシュの上限（MB）
+            'server_max_projects': '8',
+            'server_file_cache_mb': '64'
+        }
+        
+        # 任意セクションの設定（セクション名 -> {INI上のキー: 設定キー}）
+        optional_sections = {
+            'MODELS': {
+                'fast_model': 'fast_model',
+                'strong_model': 'strong_model',
+                'spec_model': 'spec_model',
+                'detailed_model': 'detailed_model',
+                'refactoring_model': 'refactoring_model',
+                'repair_model': 'repair_model'
+            },
+            'BUDGET': {
+                'spec_tokens': 'spec_token_budget',
+                'detailed_tokens': 'detailed_token_budget',
+                'refactoring_tokens': 'refactoring_token_budget'
+            },
+            'GENERATION': {
+                'max_repair_attempts': 'max_repair_attempts'
+            },
+            'RETRIEVAL': {
+                'top_k': 'retrieval_top_k'
+            },
+            'ESTIMATE': {
+                'input_cost_per_1k': 'input_cost_per_1k',
+                'output_cost_per_1k': 'output_cost_per_1k',
+                'context_window': 'context_window',
+                'expected_output_tokens': 'expected_output_tokens',
+                'output_tokens_per_second': 'output_tokens_per_second',
+                'request_overhead_seconds': 'request_overhead_seconds',
+                'requests_per_minute': 'requests_per_minute',
+                'tokens_per_minute': 'tokens_per_minute'
+            },
+            'SERVER': {
+                'host': 'server_host',
+                'port': 'server_port',
+                'workers': 'server_workers',
+                'queue_size': 'server_queue_size',
+                'allowed_roots': 'server_allowed_roots',
+                'max_projects': 'server_max_projects',
+                'file_cache_mb': 'server_file_cache_mb'
+            }
         }
         
         if os.path.exists(settings_path):
@@ -29,7 +119,11 @@ def read_settings(settings_path: str = 'settings.ini') -> dict:
             settings = {
                 'source_directory': config['DEFAULT'].get('SourceDirectory', default_settings['source_directory']),
                 'output_file': config['DEFAULT'].get('OutputFile', default_settings['output_file']),
-                'exclusions': config['DEFAULT'].get('Exclusions', default_settings['exclusions']).replace(' ', '')
+                'exclusions': config['DEFAULT'].get('Exclusions', default_settings['exclusions']).replace(' ', ''),
+                'structured_store': config['DEFAULT'].get('StructuredStore', default_settings['structured_store']).strip().lower(),
+                'store_compression': config['DEFAULT'].get('StoreCompression', default_settings['store_compression']).strip().lower(),
+                'shard_max_bytes': config['DEFAULT'].get('ShardMaxBytes', default_settings['shard_max_bytes']),
+                'shard_max_tokens': config['DEFAULT'].get('ShardMaxTokens', default_settings['shard_max_tokens'])
             }
             
             # APIセクションの設定を読み込む
@@ -42,9 +136,30 @@ def read_settings(settings_path: str = 'settings.ini') -> dict:
                     'openai_api_key': default_settings['openai_api_key'],
                     'openai_model': default_settings['openai_model']
                 })
+            
+            # 任意セクションの設定を読み込む（セクションがなければデフォルト値）
+            for section, keys in optional_sections.items():
+                for ini_key, key in keys.items():
+                    if section in config:
+                        settings[key] = config[section].get(ini_key, default_settings[key])
+                    else:
+                        settings[key] = default_settings[key]
+            
+            # モデルごとの単価（[PRICING] モデル名 = 入力単価, 出力単価）
+            if 'PRICING' in config:
+                settings['model_pricing'] = {
+                    model: value for model, value in config.items('PRICING')
+                    if model not in config.defaults()
+                }
+            # モデルごとのコンテキスト長（[CONTEXT_WINDOWS] モデル名 = トークン数）
+            if 'CONTEXT_WINDOWS' in config:
+                settings['model_context_windows'] = {
+                    model: value for model, value in config.items('CONTEXT_WINDOWS')
+                    if model not in config.defaults()
+                }
         else:
             logger.warning(f"Settings file not found at {settings_path}, using default settings")
-            settings = default_settings
+            settings = dict(default_settings)
         
         # APIキーの存在確認
         if not settings['openai_api_key']:
@@ -55,40 +170,278 @@ def read_settings(settings_path: str = 'settings.ini') -> dict:
         logger.error(f"Error reading settings file {settings_path}: {str(e)}")
         return default_settings
 
+def get_int_setting(settings: dict, key: str, default: int = 0) -> int:
+    """設定値を整数として取得（不正な値はデフォルト値）"""
+    try:
+        return int(str(settings.get(key, default)).strip())
+    except ValueError:
+        logger.warning(f"Invalid integer setting {key}: {settings.get(key)}, using {default}")
+        return default
+
+def get_float_setting(settings: dict, key: str, default: float = 0.0) -> float:
+    """設定値を小数として取得（不正な値はデフォルト値）"""
+    try:
+        return float(str(settings.get(key, default)).strip())
+    except ValueError:
+        logger.warning(f"Invalid number setting {key}: {settings.get(key)}, using {default}")
+        return default
+
+def estimate_tokens(text: str) -> int:
+    """トークン数をオフラインで概算（ASCIIは約4文字で1トークン、非ASCIIは1文字1トークン）"""
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    ascii_count = len(text) - non_ascii
+    return (ascii_count + 3) // 4 + non_ascii
+
+def format_file_block(filename: str, content: str) -> str:
+    """merge.txt 形式のファイルブロックを生成"""
+    separator = "=" * 80
+    return f"""
+{separator}
+File: {filename}
+{separator}
+
+{content}
+
+"""
+
+# merge.txt のファイルブロックの見出し（format_file_block と対応）
+FILE_BLOCK_PATTERN = re.compile(r"\n={80}\nFile: (.+)\n={80}\n\n")
+
+def split_file_blocks(merged_content: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """merge.txt 形式の内容をファイルブロックに分割
+
+    Returns:
+        (最初のファイルブロックより前の部分, [(ファイル名, 内容), ...])
+    """
+    matches = list(FILE_BLOCK_PATTERN.finditer(merged_content))
+    if not matches:
+        return merged_content, []
+    blocks = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(merged_content)
+        content = merged_content[match.end():end]
+        if content.endswith("\n\n"):
+            content = content[:-2]
+        blocks.append((match.group(1), content))
+    return merged_content[:matches[0].start()], blocks
+
+def make_temp_path(filepath: str) -> str:
+    """filepath と同じディレクトリに一時ファイルを作成してパスを返す"""
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filepath)),
+        prefix=f".{os.path.basename(filepath)}.", suffix='.tmp'
+    )
+    os.close(fd)
+    return temp_path
+
+def commit_temp_path(temp_path: str, filepath: str) -> None:
+    """一時ファイルで filepath を置き換える"""
+    # mkstempは所有者のみのパーミッションで作成するため通常のファイルと揃える
+    mode = os.stat(filepath).st_mode & 0o777 if os.path.exists(filepath) else 0o644
+    os.chmod(temp_path, mode)
+    os.replace(temp_path, filepath)
+
+@contextmanager
+def atomic_path(filepath: str) -> Iterator[str]:
+    """一時ファイルのパスを渡し、正常終了時のみ filepath に置き換える
+
+    同じディレクトリの一時ファイルに書き込んでから置き換えるため、
+    書き込み途中で中断しても不完全なファイルは残らない。
+    """
+    temp_path = make_temp_path(filepath)
+    try:
+        yield temp_path
+        commit_temp_path(temp_path, filepath)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+@contextmanager
+def atomic_open(filepath: str) -> Iterator[IO[str]]:
+    """UTF-8テキストとして書き込み、正常終了時のみ filepath に置き換える"""
+    with atomic_path(filepath) as temp_path:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
 def write_file_content(filepath: str, content: str) -> bool:
-    """ファイルに内容を書き込む"""
+    """ファイルに内容を書き込む（書き込み途中の内容は残さない）"""
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
+        with atomic_open(filepath) as f:
             f.write(content)
         return True
     except Exception as e:
         logger.error(f"Error writing to file {filepath}: {str(e)}")
         return False
 
-def read_file_safely(filepath: str) -> Optional[str]:
-    """ファイルを安全に読み込む"""
+def decode_file_bytes(data: bytes) -> Tuple[str, str]:
+    """ファイルのバイト列を文字列に変換し、判定した文字コードとともに返す
+
+    UTF-8で読めない場合はcp932として読む。改行はテキストモードでの読み込みと同様にLFに揃える。
+    """
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-            return content
+        content, encoding = data.decode('utf-8'), 'utf-8'
     except UnicodeDecodeError:
-        try:
-            with open(filepath, 'r', encoding='cp932') as f:
-                content = f.read()
-                return content
-        except Exception as e:
-            logger.error(f"Error reading file {filepath}: {str(e)}")
-            return None
+        content, encoding = data.decode('cp932'), 'cp932'
+    return content.replace('\r\n', '\n').replace('\r', '\n'), encoding
+
+def read_file_with_digest(filepath: str) -> Optional[Tuple[str, str, str, int]]:
+    """ファイルを1回だけ読み込み、内容・文字コード・元のバイト列のSHA-256とサイズを返す"""
+    try:
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        content, encoding = decode_file_bytes(data)
+        return content, encoding, hashlib.sha256(data).hexdigest(), len(data)
     except Exception as e:
         logger.error(f"Error reading file {filepath}: {str(e)}")
         return None
 
-def get_python_files(directory: str, exclude_patterns: List[str]) -> List[Tuple[str, str]]:
-    """指定ディレクトリ配下のPythonファイルを取得"""
+def read_file_with_encoding(filepath: str) -> Optional[Tuple[str, str]]:
+    """ファイルを安全に読み込み、内容と判定した文字コードを返す"""
+    result = read_file_with_digest(filepath)
+    return result[:2] if result else None
+
+def hash_file(path: str) -> Optional[str]:
+    """ファイル内容のSHA-256を取得（存在しない場合は None）"""
+    try:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    except OSError:
+        return None
+
+class FileContentCache:
+    """更新時刻とサイズが変わらないファイルの読み込み結果・ハッシュ・ファイル一覧を保持するキャッシュ
+
+    常駐プロセスでプロジェクトごとに保持し、変更のないファイルの再読み込みやディレクトリの再走査を避ける。
+    読み込んだ内容は max_bytes（ファイルサイズの合計、0 は無制限）を超えると古いものから破棄する。
+    """
+
+    def __init__(self, max_bytes: int = 0):
+        self._lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, Tuple[int, int, str, str, str, int]]" = OrderedDict()
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+        # (ディレクトリ, 除外パターン) -> (走査したディレクトリの更新時刻, ファイル一覧, 派生値)
+        self._listings: Dict[Tuple[str, Tuple[str, ...]], Tuple[Dict[str, int], List[Tuple[str, str]], Dict]] = {}
+
+    def read(self, filepath: str) -> Optional[Tuple[str, str]]:
+        """ファイルを読み込む（変更がなければキャッシュを返す）"""
+        result = self.read_with_digest(filepath)
+        return result[:2] if result else None
+
+    def read_with_digest(self, filepath: str) -> Optional[Tuple[str, str, str, int]]:
+        """read_file_with_digest と同じ値を取得（変更がなければキャッシュを返す）"""
+        try:
+            stat = os.stat(filepath)
+        except OSError as e:
+            logger.error(f"Error reading file {filepath}: {str(e)}")
+            return None
+        key = os.path.abspath(filepath)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                self._entries.move_to_end(key)
+                return entry[2:]
+
+        result = read_file_with_digest(filepath)
+        if result is not None:
+            # 読み込んだバイト列のハッシュは file_hash でも再利用する
+            with self._lock:
+                self._hashes[key] = (stat.st_mtime_ns, stat.st_size, result[2])
+            self._store(key, (stat.st_mtime_ns, stat.st_size) + result)
+        return result
+
+    def _store(self, key: str, entry: Tuple[int, int, str, str, str, int]) -> None:
+        """読み込み結果を保存（上限を超えた場合は古いものから削除）"""
+        if self.max_bytes and entry[1] > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self.total_bytes -= previous[1]
+            self._entries[key] = entry
+            self.total_bytes += entry[1]
+            while self.max_bytes and self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted[1]
+
+    def file_hash(self, filepath: str) -> Optional[str]:
+        """ファイルのSHA-256を取得（更新時刻とサイズが変わらなければ再計算しない）"""
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        key = os.path.abspath(filepath)
+        with self._lock:
+            entry = self._hashes.get(key)
+        if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[2]
+
+        digest = hash_file(filepath)
+        if digest is not None:
+            with self._lock:
+                self._hashes[key] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def _current_listing(self, directory: str, exclude_patterns: List[str]):
+        """ファイル一覧を取得（走査したディレクトリの更新時刻が変わった場合のみ再走査）"""
+        key = (os.path.abspath(directory), tuple(exclude_patterns))
+        with self._lock:
+            listing = self._listings.get(key)
+        if listing is not None:
+            try:
+                if all(os.stat(path).st_mtime_ns == mtime for path, mtime in listing[0].items()):
+                    return listing
+            except OSError:
+                pass
+
+        dir_mtimes: Dict[str, int] = {}
+        listing = (dir_mtimes, get_python_files(directory, exclude_patterns, dir_mtimes), {})
+        with self._lock:
+            self._listings[key] = listing
+        return listing
+
+    def python_files(self, directory: str, exclude_patterns: List[str]) -> List[Tuple[str, str]]:
+        """get_python_files と同じ一覧を取得（ディレクトリに変更がなければ走査しない）"""
+        return list(self._current_listing(directory, exclude_patterns)[1])
+
+    def cached_for_listing(self, directory: str, exclude_patterns: List[str], name: str,
+                           compute: Callable[[], T]) -> T:
+        """ファイル一覧が変わらない限り compute の結果を再利用（ディレクトリ構造など）"""
+        derived = self._current_listing(directory, exclude_patterns)[2]
+        with self._lock:
+            if name in derived:
+                return derived[name]
+        value = compute()
+        with self._lock:
+            derived[name] = value
+        return value
+
+def read_file_safely(filepath: str) -> Optional[str]:
+    """ファイルを安全に読み込む"""
+    result = read_file_with_encoding(filepath)
+    return result[0] if result else None
+
+def get_python_files(directory: str, exclude_patterns: List[str],
+                     dir_mtimes: Optional[Dict[str, int]] = None) -> List[Tuple[str, str]]:
+    """指定ディレクトリ配下のPythonファイルを取得
+
+    Args:
+        dir_mtimes (Optional[Dict[str, int]]): 指定した場合、走査したディレクトリの更新時刻を記録
+    """
     python_files = []
     
     try:
         for root, dirs, files in os.walk(directory):
+            if dir_mtimes is not None:
+                dir_mtimes[root] = os.stat(root).st_mtime_ns
             # ディレクトリ名を基にした除外チェック
             dir_name = os.path.basename(root)
             should_skip = any(